@@ -1,15 +1,50 @@
-import sys
+import argparse
+import json
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from itertools import groupby
 from pathlib import Path
 
 import docint  # noqa
 import orgpedia  # noqa
+import yaml
 
 import question_extractor2
+import question_lines
 import info_reader
 import find_dashes
 import question_translator
 import question_writer
 import filter_words
+import answer_templates
+import text_cache
+import trans_memory
+import trans_table
+from build_manifest import BuildManifest
+from doc_checkpoint import CheckpointPipeline
+
+PipelineFile = "src/writeTxt.yml"
+ManifestFile = "build_manifest.json"
+
+StageModules = [
+    question_extractor2,
+    question_lines,
+    info_reader,
+    find_dashes,
+    question_translator,
+    question_writer,
+    filter_words,
+    answer_templates,
+    text_cache,
+    trans_memory,
+    trans_table,
+]
+
+# translation todos are sharded by 100 document ranges (see QuestionTranslator.get_range_str),
+# all documents of a range are handled by the same worker to avoid clobbering the todo files.
+RangeSize = 100
+
+worker_pipeline = None
 
 
 def order_num(pdf_path):
@@ -17,24 +52,171 @@ def order_num(pdf_path):
     return int(num)
 
 
-if __name__ == "__main__":
-    input_path = Path(sys.argv[1])
-    output_path = Path(sys.argv[2])
+def range_num(pdf_path):
+    return order_num(pdf_path) // RangeSize
+
+
+def get_output_doc_path(output_path, pdf_file):
+    return output_path / (pdf_file.name + ".doc.json.gz")
+
+
+def get_pipeline_config():
+    return yaml.safe_load(Path(PipelineFile).read_text())
+
+
+def get_trans_config():
+    # translations in the memory or the table are not in the trans-{range} files of a document
+    pipeline = get_pipeline_config()["pipeline"]
+    stage_configs = dict((c["name"], c.get("config", {}) or {}) for c in pipeline)
+    return stage_configs.get("question_translator", {})
+
+
+def load_manifest(output_path):
+    source_files = [Path(PipelineFile)] + [Path(m.__file__) for m in StageModules]
+
+    trans_config = get_trans_config()
+    trans_table_file = trans_config.get("trans_table", question_translator.TransTableFile)
+    return BuildManifest(
+        output_path / ManifestFile,
+        source_files,
+        output_dir=output_path,
+        data_files=[Path(trans_table_file)] if trans_table_file else [],
+        trans_memory_file=trans_config.get("trans_memory", ""),
+    )
+
+
+def init_worker():
+    global worker_pipeline
+    config = get_pipeline_config()
+    viz = docint.load(PipelineFile)
+    worker_pipeline = CheckpointPipeline(viz, config["pipeline"], config["checkpoint_dir"])
+
+
+def process_documents(pdf_files, output_path, from_stage):
+    if worker_pipeline is None:
+        init_worker()
+
+    failures = []
+    for pdf_file in pdf_files:
+        try:
+            doc = worker_pipeline(pdf_file, from_stage)
+            doc.to_disk(get_output_doc_path(output_path, pdf_file))
+        except Exception as e:
+            print(f"FAILED: {pdf_file.name} {type(e).__name__}: {e}")
+            failures.append(
+                {
+                    "name": pdf_file.name,
+                    "error": f"{type(e).__name__}: {e}",
+                    "traceback": traceback.format_exc(),
+                }
+            )
+    return failures
 
-    viz = docint.load("src/writeTxt.yml")
+
+def process_all(pdf_files, output_path, num_workers, from_stage, manifest):
+    ignore_docs = get_pipeline_config().get("ignore_docs", {}) or {}
+    pdf_files = [p for p in pdf_files if p.name not in ignore_docs]
+    range_batches = [list(b) for (_, b) in groupby(pdf_files, key=range_num)]
+
+    failures = []
+    if num_workers <= 1:
+        for batch in range_batches:
+            failures += process_documents(batch, output_path, from_stage)
+    else:
+        print(f"#docs: {len(pdf_files)} #batches: {len(range_batches)} #workers: {num_workers}")
+        with ProcessPoolExecutor(max_workers=num_workers, initializer=init_worker) as executor:
+            futures = [
+                executor.submit(process_documents, b, output_path, from_stage)
+                for b in range_batches
+            ]
+            for future in as_completed(futures):
+                failures += future.result()
+
+    failures_file = output_path / "failures.json"
+    failures_file.write_text(json.dumps(failures, indent=2, ensure_ascii=False))
+    print(f"Processed #docs: {len(pdf_files)} #failed: {len(failures)} -> {failures_file}")
+
+    failed_names = set(f["name"] for f in failures)
+    for pdf_file in pdf_files:
+        if pdf_file.name not in failed_names:
+            manifest.update(pdf_file)
+    manifest.save()
+
+
+def pipe_all(pdf_files, output_path, manifest):
+    config = get_pipeline_config()
+    viz = docint.load(PipelineFile)
+    pipeline = CheckpointPipeline(viz, config["pipeline"], config["checkpoint_dir"])
+
+    ignore_docs = config.get("ignore_docs", {}) or {}
+    pdf_files = [p for p in pdf_files if p.name not in ignore_docs]
+    pdf_files_dict = dict((p.name, p) for p in pdf_files)
+
+    # checkpoints are saved here as well, a later --from-stage run resumes from them
+    docs = pipeline.pipe_all(pdf_files)
+    for doc in docs:
+        doc.to_disk(get_output_doc_path(output_path, pdf_files_dict[doc.pdf_name]))
+        manifest.update(pdf_files_dict[doc.pdf_name])
+    manifest.save()
+
+
+def process_stale(pdf_files, output_path, num_workers, from_stage, force):
+    manifest = load_manifest(output_path)
+    if not force:
+        num_files = len(pdf_files)
+        pdf_files = [
+            p for p in pdf_files if manifest.is_stale(p, get_output_doc_path(output_path, p))
+        ]
+        print(f"Stale #docs: {len(pdf_files)} Unchanged #docs: {num_files - len(pdf_files)}")
+
+    if not pdf_files:
+        manifest.save()
+        return
+
+    if num_workers or from_stage:
+        process_all(pdf_files, output_path, num_workers, from_stage, manifest)
+    else:
+        pipe_all(pdf_files, output_path, manifest)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Extract questions and answers from the pdfs.")
+    parser.add_argument("input_path", help="pdf file, directory of pdfs or a .lst file")
+    parser.add_argument("output_path", help="output doc file or directory")
+    parser.add_argument(
+        "-w",
+        "--workers",
+        type=int,
+        default=0,
+        help="process documents in N worker processes, failed documents go to failures.json",
+    )
+    parser.add_argument(
+        "-f", "--force", action="store_true", help="process all documents, ignore build manifest"
+    )
+    parser.add_argument(
+        "-s",
+        "--from-stage",
+        default=None,
+        help="resume from the checkpoint of the nearest checkpointed stage before this stage",
+    )
+    args = parser.parse_args()
+
+    stage_names = [c["name"] for c in get_pipeline_config()["pipeline"]]
+    if args.from_stage and args.from_stage not in stage_names:
+        parser.error(f"Unknown stage: {args.from_stage}, expected one of {stage_names}")
+
+    input_path = Path(args.input_path)
+    output_path = Path(args.output_path)
 
     if input_path.is_dir():
         assert output_path.is_dir(), f'{output_path} is not directory'
         input_files = sorted(input_path.glob("*.pdf"), key=order_num)
         print(len(input_files))
 
-        # docs = viz.pipe_all(input_files[:3])
-        docs = viz.pipe_all(input_files)
+        process_stale(input_files, output_path, args.workers, args.from_stage, args.force)
 
-        for doc in docs:
-            output_doc_path = output_path / (doc.pdf_name + ".doc.json.gz")
-            doc.to_disk(output_doc_path)
     elif input_path.suffix.lower() == ".pdf":
+        viz = docint.load(PipelineFile)
         doc = viz(input_path)
         doc.to_disk(output_path)
 
@@ -45,7 +227,9 @@ if __name__ == "__main__":
         pdf_files = [Path("input") / f for f in input_files if f and f[0] != "#"]
         pdf_files = [p for p in pdf_files if p.exists()]
 
-        docs = viz.pipe_all(pdf_files)
-        for doc in docs:
-            output_doc_path = output_path / (doc.pdf_name + ".doc.json.gz")
-            doc.to_disk(output_doc_path)
+        pdf_files = sorted(pdf_files, key=order_num)
+        process_stale(pdf_files, output_path, args.workers, args.from_stage, args.force)
+
+
+if __name__ == "__main__":
+    main()
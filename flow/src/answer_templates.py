@@ -0,0 +1,83 @@
+import re
+import unicodedata
+
+# formulaic sub answers, keyed on the text without the sub point numbers and trailing stops
+AnswerTemplates = {
+    'होय': 'Yes',
+    'नाही': 'No',
+    'हे खरे आहे': 'This is true',
+    'हे खरे नाही': 'This is not true',
+    'खरे आहे': 'True',
+    'खरे नाही': 'Not true',
+    'हे अंशतः खरे आहे': 'This is partly true',
+    'अंशतः खरे आहे': 'Partly true',
+    'अंशत: खरे आहे': 'Partly true',
+    'हे अंशत: खरे आहे': 'This is partly true',
+    'प्रश्न उद्भवत नाही': 'The question does not arise',
+    'उद्भवत नाही': 'Does not arise',
+    'लागू नाही': 'Not applicable',
+    'माहिती संकलित करण्यात येत आहे': 'The information is being collected',
+}
+
+# words joining the sub point numbers, '(१) व (२)' -> '(1) and (2)'
+NumJoinWords = {'व': 'and', 'आणि': 'and', 'ते': 'to', ',': ','}
+
+SubPointPattern = re.compile(r'\s*\((\d+)\)\s*')
+PhraseSepPattern = re.compile(r'\s*[,;]\s*')
+SpacePattern = re.compile(r'\s+')
+
+# answers often end with a full stop, a danda or a dash
+TrailingChars = ' .।-–'
+
+
+def normalize_phrase(text):
+    text = unicodedata.normalize('NFC', text)
+    return SpacePattern.sub(' ', text).strip(TrailingChars)
+
+
+class AnswerTemplateTranslator:
+    """Translates the formulaic sub answers ('(१) होय.', '(२) व (३) हे खरे नाही') without the
+    model. The sub point numbers are translated digit by digit with num_dict, the rest of the
+    text has to be a template phrase, or template phrases separated by commas.
+    """
+
+    def __init__(self, num_dict, templates=AnswerTemplates):
+        self.num_dict = num_dict
+        self.templates = dict((normalize_phrase(m), e) for (m, e) in templates.items())
+
+    def trans_num(self, num_str):
+        return ''.join(self.num_dict.get(c, c) for c in num_str)
+
+    def split_prefix(self, text):
+        # returns the translated sub point prefix and the remaining text
+        prefix_parts, pos = [], 0
+        while True:
+            match = SubPointPattern.match(text, pos)
+            if match:
+                prefix_parts.append(f'({self.trans_num(match.group(1))})')
+                pos = match.end()
+                continue
+
+            if not prefix_parts:
+                break
+
+            join_word = next((w for w in NumJoinWords if text.startswith(w, pos)), None)
+            next_match = SubPointPattern.match(text, pos + len(join_word)) if join_word else None
+            if not next_match:
+                break
+
+            prefix_parts.append(NumJoinWords[join_word])
+            pos += len(join_word)
+        return ' '.join(prefix_parts).replace(' ,', ','), text[pos:]
+
+    def translate(self, text):
+        """Returns the translation if the text is a template answer, None otherwise."""
+        prefix, body = self.split_prefix(text.strip())
+        phrases = [normalize_phrase(p) for p in PhraseSepPattern.split(body)]
+        if not all(p in self.templates for p in phrases):
+            return None
+
+        phrase_trans = [self.templates[p] for p in phrases]
+        phrase_trans[1:] = [t[0].lower() + t[1:] for t in phrase_trans[1:]]
+        body_trans = ', '.join(phrase_trans) + '.'
+        return f'{prefix} {body_trans}' if prefix else body_trans
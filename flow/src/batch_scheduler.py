@@ -0,0 +1,76 @@
+import time
+from operator import itemgetter
+from pathlib import Path
+
+# padded tokens in a batch, the length of the longest sentence times the number of sentences
+BatchTokens = 4096
+MaxBatchSize = 256
+
+
+class BatchScheduler:
+    """Sorts the sentences on their sentencepiece length and cuts the sorted list into
+    batches of at most max_tokens padded tokens, so short names and roles are not padded to
+    the length of long answers. The translations are returned in the input order.
+    """
+
+    def __init__(self, sp_model_file=None, max_tokens=BatchTokens, max_batch_size=MaxBatchSize):
+        self.sp = None
+        if sp_model_file and Path(sp_model_file).exists():
+            import sentencepiece as spm
+
+            self.sp = spm.SentencePieceProcessor(model_file=str(sp_model_file))
+
+        self.max_tokens = max_tokens
+        self.max_batch_size = max_batch_size
+
+        self.num_tokens, self.num_sents, self.num_batches = 0, 0, 0
+        self.translate_secs = 0.0
+
+    def token_len(self, sent):
+        # words are used if the sentencepiece model is not available
+        return len(self.sp.encode(sent)) if self.sp else len(sent.split())
+
+    def get_batches(self, sents):
+        """Returns the batches as lists of (idx, token_len), idx is the position in sents."""
+        sent_lens = [(idx, self.token_len(s)) for (idx, s) in enumerate(sents)]
+        sent_lens.sort(key=itemgetter(1))
+
+        batches, batch = [], []
+        for (idx, sent_len) in sent_lens:
+            # sorted ascending, so the current sentence is the longest in the batch
+            padded_tokens = (len(batch) + 1) * sent_len
+            if batch and (padded_tokens > self.max_tokens or len(batch) >= self.max_batch_size):
+                batches.append(batch)
+                batch = []
+            batch.append((idx, sent_len))
+
+        if batch:
+            batches.append(batch)
+        return batches
+
+    def translate(self, sents, translate_fn):
+        """translate_fn translates a list of sentences, it is called once per batch."""
+        sents = list(sents)
+        translations = [None] * len(sents)
+        for batch in self.get_batches(sents):
+            batch_sents = [sents[idx] for (idx, _) in batch]
+
+            start = time.perf_counter()
+            batch_trans = translate_fn(batch_sents)
+            self.translate_secs += time.perf_counter() - start
+
+            assert len(batch_trans) == len(batch_sents)
+            for ((idx, _), trans) in zip(batch, batch_trans):
+                translations[idx] = trans
+
+            self.num_tokens += sum(sent_len for (_, sent_len) in batch)
+            self.num_sents += len(batch)
+            self.num_batches += 1
+        return translations
+
+    def throughput_str(self):
+        tokens_per_sec = self.num_tokens / self.translate_secs if self.translate_secs else 0.0
+        return (
+            f'#sents: {self.num_sents} #batches: {self.num_batches} #tokens: {self.num_tokens}'
+            f' time: {self.translate_secs:.1f}s tokens/sec: {tokens_per_sec:.1f}'
+        )
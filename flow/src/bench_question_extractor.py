@@ -0,0 +1,150 @@
+"""
+Compares QuestionExtractor.build_question against the earlier line scanning implementation
+on the documents whose OCR output is present in the output directory. Run from flow/doOCR_
+
+    python ../src/bench_question_extractor.py src/writeTxt.yml input output
+"""
+import re
+import sys
+import time
+from pathlib import Path
+
+import docint  # noqa
+import orgpedia  # noqa
+
+import filter_words  # noqa
+import find_dashes  # noqa
+import info_reader  # noqa
+from question_extractor2 import QuestionExtractor, Saluts
+
+
+def reference_build_question(extractor, question_lines, doc_type):
+    def is_header_start(line):
+        line_text = line.text_with_break().strip()
+        line_text = line_text.replace('–', '-')
+        if doc_type == 'StarredQuestions':
+            pattern = r"^\(\s*(\d+)\s*\)\s*([\*])*\s*([\d\s]*)\s+"
+            return bool(re.match(pattern, line_text))
+        else:
+            pattern = r"^\(\s*(\d+)\s*\)\s+(\s*\d+\s*)\s*\(\s*(\d+-\d+-\d+)\s*\)"
+            return bool(re.match(pattern, line_text))
+
+    def is_question_start(line):
+        line_text = line.text_with_break().strip().strip('◌़')
+        line_text = line_text.replace('–', '-')
+
+        if not line_text:
+            return False
+
+        m = re.match(r'^\(\s*(\d+)\s*\)|^(\d+)\)', line_text)
+        if not m:
+            return False
+
+        match_num = m.group(1) if m.group(1) else m.group(2)
+        return int(match_num) == 1
+
+    def is_answer_start(line):
+        if 'उत्तर आले नाही' in line.text_with_break():
+            return True
+
+        line_text = line.text_with_break().strip().strip('◌़')
+        if not line_text:
+            return False
+        return line_text.startswith(Saluts) or bool(re.match(r'^: \(\s*(\d+)\s*\)', line_text))
+
+    def texts(lines):
+        return [ln.text_with_break() for ln in lines]
+
+    question = {}
+    section, section_lines = 'title', []
+    for line in question_lines:
+        if section == 'title' and is_header_start(line):
+            question['title'] = ' '.join(texts(section_lines)).strip('*')
+            section, section_lines = 'header', []
+
+        elif section == 'header' and is_question_start(line):
+            question = {**question, **extractor.parse_header(texts(section_lines))}
+            section, section_lines = 'question', []
+
+        elif section == 'question' and is_answer_start(line):
+            question = {**question, **extractor.parse_question(texts(section_lines))}
+            section, section_lines = 'answer', []
+
+        if line.words:
+            section_lines.append(line)
+
+    question = {**question, **extractor.parse_answer(texts(section_lines))}
+    return question
+
+
+def get_question_lines(extractor, doc):
+    for (page_idx, line_idx, question_lines) in extractor.question_iter(doc):
+        if (page_idx == 0 and len(question_lines) < 12) or len(question_lines) < 8:
+            continue
+        yield question_lines
+
+
+def run_build(build_func, all_question_lines):
+    questions, start = [], time.perf_counter()
+    for question_lines in all_question_lines:
+        try:
+            questions.append(build_func(question_lines))
+        except ValueError as e:
+            questions.append(f'ValueError: {e}')
+    return questions, time.perf_counter() - start
+
+
+def main():
+    pipeline_file, input_dir, output_dir = [Path(a) for a in sys.argv[1:4]]
+
+    viz = docint.load(pipeline_file)
+    stages = []
+    for (name, proc) in viz.pipeline:
+        if name == 'question_extractor2':
+            break
+        stages.append(proc)
+
+    extractor = QuestionExtractor('question_extractor')
+
+    ocr_names = set(p.name.split('.ocr')[0] for p in output_dir.glob('*.pdf.ocr*.json.gz'))
+    pdf_files = sorted(p for p in input_dir.glob('*.pdf') if p.name in ocr_names)
+
+    total_ref, total_new, num_mismatch = 0.0, 0.0, 0
+    print(f'{"document":20s} {"#qs":>5s} {"before(ms)":>11s} {"after(ms)":>10s}')
+    for pdf_file in pdf_files:
+        if pdf_file.name in viz.ignore_docs:
+            continue
+
+        doc = viz.build_doc(pdf_file)
+        for proc in stages:
+            doc = proc(doc)
+
+        doc_type = doc.info['doc_type']
+        if doc_type not in ('StarredQuestions', 'UnstarredQuestions'):
+            continue
+
+        all_question_lines = list(get_question_lines(extractor, doc))
+
+        def ref_build(lines):
+            return reference_build_question(extractor, lines, doc_type)
+
+        def new_build(lines):
+            return extractor.build_question(0, 0, lines, 0, doc_type)
+
+        ref_questions, ref_time = run_build(ref_build, all_question_lines)
+        new_questions, new_time = run_build(new_build, all_question_lines)
+
+        if ref_questions != new_questions:
+            num_mismatch += 1
+            print(f'MISMATCH: {pdf_file.name}')
+
+        total_ref, total_new = total_ref + ref_time, total_new + new_time
+        num_qs = len(all_question_lines)
+        print(f'{pdf_file.name:20s} {num_qs:5d} {ref_time*1000:11.2f} {new_time*1000:10.2f}')
+
+    print(f'{"total":20s} {"":5s} {total_ref*1000:11.2f} {total_new*1000:10.2f}')
+    print(f'#mismatched documents: {num_mismatch}')
+
+
+if __name__ == "__main__":
+    main()
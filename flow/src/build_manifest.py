@@ -0,0 +1,129 @@
+import hashlib
+import json
+from pathlib import Path
+
+from trans_memory import read_content_version
+
+RangeSize = 100
+
+
+def get_range_str(doc_num):
+    # same sharding as QuestionTranslator.get_range_str, 423 -> '401-500'
+    base_num = doc_num - (doc_num % RangeSize)
+    return f'{base_num+1}-{base_num+RangeSize}'
+
+
+class FileHashes:
+    """Hashes of files, kept in file_stats, a hash is reused as long as the size and mtime of
+    the file are unchanged.
+    """
+
+    def __init__(self, file_stats):
+        self.file_stats = file_stats
+
+    def file_hash(self, path):
+        if not path.exists():
+            return ''
+
+        stat = path.stat()
+        stat_key = [stat.st_size, stat.st_mtime_ns]
+
+        file_stat = self.file_stats.get(str(path), {})
+        if file_stat.get('stat') == stat_key:
+            return file_stat['sha']
+
+        sha = hashlib.sha256(path.read_bytes()).hexdigest()
+        self.file_stats[str(path)] = {'stat': stat_key, 'sha': sha}
+        return sha
+
+    def hash_files(self, paths):
+        h = hashlib.sha256()
+        for path in paths:
+            h.update(f'{path.name}:{self.file_hash(path)}\n'.encode('utf-8'))
+        return h.hexdigest()
+
+
+class BuildManifest(FileHashes):
+    """Records per document the hashes of everything that goes into its output, a document
+    is rebuilt only when one of them changes.
+    """
+
+    def __init__(
+        self,
+        manifest_file,
+        source_files,
+        conf_dir='conf',
+        output_dir='output',
+        data_files=(),
+        trans_memory_file='',
+    ):
+        self.manifest_file = Path(manifest_file)
+        self.conf_dir = Path(conf_dir)
+        self.output_dir = Path(output_dir)
+        self.trans_dir = self.conf_dir / 'trans'
+
+        # export_data.py shares FileHashes, the module does not depend on docint
+        if self.manifest_file.exists() and self.manifest_file.stat().st_size:
+            manifest = json.loads(self.manifest_file.read_text())
+        else:
+            manifest = {}
+
+        self.docs = manifest.get('docs', {})
+        super().__init__(manifest.get('file_stats', {}))
+
+        infos = json.loads((self.conf_dir / 'documents.json').read_text())
+        self.infos_dict = dict((i['name'], i) for i in infos)
+
+        self.source_hash = self.hash_files(sorted(Path(f) for f in source_files))
+
+        # files read by all the documents, e.g. the translation table, and the memory
+        self.data_files = [Path(f) for f in data_files]
+        self.trans_memory_file = trans_memory_file
+        self.data_hash = self.get_data_hash()
+        self.updated_names = set()
+
+    def get_data_hash(self):
+        # the memory is hashed by its content version, not by the bytes of the sqlite file
+        memory_file = self.trans_memory_file
+        memory_version = read_content_version(memory_file) if memory_file else ''
+        data_str = f'{self.hash_files(self.data_files)}:{memory_version}'
+        return hashlib.sha256(data_str.encode('utf-8')).hexdigest()
+
+    def get_hashes(self, pdf_path):
+        pdf_name = pdf_path.name
+        doc_num = int(pdf_path.stem.rsplit('-', 1)[1])
+        range_str = get_range_str(doc_num)
+
+        info = self.infos_dict.get(pdf_name, None)
+        info_str = json.dumps(info, sort_keys=True, ensure_ascii=False)
+
+        return {
+            'pdf': self.file_hash(pdf_path),
+            'ocr': self.hash_files(sorted(self.output_dir.glob(f'{pdf_name}.ocr*.json.gz'))),
+            'conf': self.hash_files(sorted(self.conf_dir.glob(f'{pdf_name}.*.yml'))),
+            'info': hashlib.sha256(info_str.encode('utf-8')).hexdigest(),
+            'trans': self.hash_files(sorted(self.trans_dir.glob(f'trans-{range_str}.json*'))),
+            'source': self.source_hash,
+            'data': self.data_hash,
+        }
+
+    def is_stale(self, pdf_path, output_doc_path):
+        if not output_doc_path.exists():
+            return True
+
+        doc_hashes = self.docs.get(pdf_path.name, None)
+        return doc_hashes != self.get_hashes(pdf_path)
+
+    def update(self, pdf_path):
+        self.docs[pdf_path.name] = self.get_hashes(pdf_path)
+        self.updated_names.add(pdf_path.name)
+
+    def save(self):
+        # the run adds its own translations to the memory, the documents it built are recorded
+        # with the data after the run so that those writes do not make them stale
+        data_hash = self.get_data_hash()
+        for name in self.updated_names:
+            self.docs[name]['data'] = data_hash
+
+        manifest = {'docs': self.docs, 'file_stats': self.file_stats}
+        self.manifest_file.write_text(json.dumps(manifest, indent=2, sort_keys=True))
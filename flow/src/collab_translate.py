@@ -1,9 +1,17 @@
 import gzip
+import hashlib
+import inspect
 import json
 import multiprocessing
 import os
+import queue
 import re
+import socket
 import sys
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from itertools import tee
 from pathlib import Path
 
@@ -12,6 +20,10 @@ import sentencepiece as spm
 from indicnlp.normalize import indic_normalize
 from indicnlp.tokenize import indic_tokenize
 
+from text_cache import TextCache
+from trans_memory import TransMemory, get_file_range, read_trans_file, unique_texts
+from trans_queue import TransQueue
+
 
 def pairwise(iterable):
     # pairwise('ABCDEFG') --> AB BC CD DE EF FG
@@ -23,69 +35,54 @@ ModelDir = os.environ.get(
     "MODEL_DIR", "../../../import/models/ai4bharat/IndicTrans2-en/ct2_int8_model"
 )
 
-class Translator:
-    def __init__(self, trans_file, todo_file, src_lang, tgt_lang, ckpt_dir=ModelDir):
-        
-        self.trans_file = Path(trans_file)
-        self.todo_file = Path(todo_file)
+# sqlite translation memory, when set the translations are saved to it after each batch
+TransMemoryPath = os.environ.get("TRANS_MEMORY", "")
 
-        if not self.trans_file.exists():
-            self.trans = {}
-        elif self.trans_file.name.endswith('gz'):
-            with gzip.open(self.trans_file, "rb") as f:
-                trans_list = json.loads(f.read())
-            self.trans = dict( (ln['mr'], ln['en']) for ln in trans_list)
-        else:
-            trans_list = json.loads(self.trans_file.read_text())
-            self.trans = dict( (ln['mr'], ln['en']) for ln in trans_list)
+# sqlite work queue shared by the workers, when set the todos are queued and leased from it
+TransQueuePath = os.environ.get("TRANS_QUEUE", "")
 
+# cache of the segmented paragraphs and preprocessed sentences, next to the trans file if unset
+TextCachePath = os.environ.get("TEXT_CACHE", "")
 
-        if self.todo_file.name.endswith('gz'):
-            with gzip.open(todo_file, "rb") as f:
-                self.todos = json.loads(f.read())
-        else:
-            self.todos = json.loads(self.todo_file.read_text())
-            
-        
-        self.src_lang = src_lang
-        self.tgt_lang = tgt_lang
+# greedy decoding, beam search multiplies the decoding cost on cpu
+BeamSize = 1
+MaxSeqLen = 256
 
+# sentences preprocessed by a worker in one task, paragraphs segmented in one task
+SentChunkSize = 128
+ParaChunkSize = 64
 
-        self.queue_len = 4
-        self.max_batch_size = 1024 * self.queue_len
-        self.num_threads = multiprocessing.cpu_count() // 2
+# number of preprocessed chunks waiting for the model, and translated ones for postprocessing
+QueueSize = 4
 
-        self.file_batch_size = 5000
 
-        device = "cpu"
-        # import ctranslate2
-        # self.ckpt_dir = ckpt_dir
-        # self.device = device
-        # self.translator = ctranslate2.Translator(
-        #     self.ckpt_dir,
-        #     device=self.device,
-        #     device_index=0,
-        #     #inter_threads=self.num_threads,
-        #     #intra_threads=4,
-        #     compute_type="default")
-
-        self.sp_src = spm.SentencePieceProcessor(
-            model_file=os.path.join(ckpt_dir, "vocab", "model.SRC")
-        )
-        self.sp_tgt = spm.SentencePieceProcessor(
-            model_file=os.path.join(ckpt_dir, "vocab", "model.TGT")
-        )
+class Preprocessor:
+    """Segments the paragraphs and preprocesses the sentences for the model, this runs in the
+    preprocessing worker processes.
+    """
+
+    def __init__(self, ckpt_dir, src_lang, tgt_lang):
+        self.src_lang = src_lang
+        self.tgt_lang = tgt_lang
+
+        self.spm_src_file = Path(ckpt_dir) / "vocab" / "model.SRC"
+        self.sp_src = spm.SentencePieceProcessor(model_file=str(self.spm_src_file))
 
         normfactory = indic_normalize.IndicNormalizerFactory()
         self.normalizer = normfactory.get_normalizer('mr')# self.src_lang)
 
         self.seg = pysbd.Segmenter(language="mr", clean=False)
 
-    def save_translations(self):
-        save_trans = [{"mr": k, "en": v} for (k, v) in self.translations.items()]
+    def get_model_id(self):
+        """Hash of the spm model and the normalizer source, the preprocessed sentences are
+        cached per model id so that another checkpoint does not reuse stale tokens.
+        """
+        h = hashlib.sha1(self.spm_src_file.read_bytes())
+        h.update(Path(inspect.getsourcefile(type(self.normalizer))).read_bytes())
+        return h.hexdigest()[:16]
 
-        with gzip.open(self.trans_file, "wb") as f:
-            f.write(bytes(json.dumps(save_trans, ensure_ascii=False), encoding='utf-8'))
+    def segment_paras(self, paras):
+        return [[s.strip() for s in self.seg.segment(para)] for para in paras]
 
     def preprocess_sents(self, sents):
         def process(sent):
@@ -134,6 +131,117 @@ class Translator:
 
         return tagged_sents
 
+
+_preprocessor = None
+
+
+def init_preprocessor(ckpt_dir, src_lang, tgt_lang):
+    global _preprocessor
+    _preprocessor = Preprocessor(ckpt_dir, src_lang, tgt_lang)
+
+
+def segment_paras(paras):
+    return _preprocessor.segment_paras(paras)
+
+
+def preprocess_sents(sents):
+    return _preprocessor.preprocess_sents(sents)
+
+
+class Translator:
+    def __init__(self, trans_file, todo_file, src_lang, tgt_lang, ckpt_dir=ModelDir):
+        # the trans_file and todo_file are None when the texts are leased from a TransQueue
+        self.trans_file = Path(trans_file) if trans_file else None
+        self.todo_file = Path(todo_file) if todo_file else None
+
+        if not self.todo_file:
+            self.todos = {'paras': [], 'sents': []}
+        elif self.todo_file.name.endswith('gz'):
+            with gzip.open(todo_file, "rb") as f:
+                self.todos = json.loads(f.read())
+        else:
+            self.todos = json.loads(self.todo_file.read_text())
+
+        self.trans_memory = TransMemory(TransMemoryPath) if TransMemoryPath else None
+        self.range_str = get_file_range(self.trans_file) if self.trans_file else None
+
+        if not self.trans_file:
+            self.trans = {}
+        elif self.trans_memory:
+            todo_texts = self.todos.get('paras', []) + self.todos.get('sents', [])
+            self.trans = self.trans_memory.get_many(todo_texts, self.range_str)
+        else:
+            # resume from the last saved translations, or the plain json if there is no gz
+            plain_file = self.trans_file.parent / self.trans_file.name.replace('.gz', '')
+            saved_file = self.trans_file if self.trans_file.exists() else plain_file
+            self.trans = dict( (ln['mr'], ln['en']) for ln in read_trans_file(saved_file))
+
+        self.src_lang = src_lang
+        self.tgt_lang = tgt_lang
+
+        # a batch of max_batch_size tokens is split by ctranslate2 into queue_len sub batches
+        # that are translated in parallel, one per inter thread, the cores are shared by them.
+        self.queue_len = 4
+        self.sub_batch_size = 1024
+        self.max_batch_size = self.sub_batch_size * self.queue_len
+        self.inter_threads = self.queue_len
+        self.intra_threads = max(1, multiprocessing.cpu_count() // self.inter_threads)
+
+        self.file_batch_size = 5000
+
+        import ctranslate2
+
+        self.ckpt_dir = ckpt_dir
+        self.device = "cpu"
+        self.translator = ctranslate2.Translator(
+            self.ckpt_dir,
+            device=self.device,
+            inter_threads=self.inter_threads,
+            intra_threads=self.intra_threads,
+            compute_type="default",
+        )
+
+        self.sp_tgt = spm.SentencePieceProcessor(
+            model_file=os.path.join(ckpt_dir, "vocab", "model.TGT")
+        )
+
+        # preprocessing runs in worker processes while the model translates, the cores not
+        # taken by the model threads are left to the workers
+        self.preprocessor = Preprocessor(ckpt_dir, src_lang, tgt_lang)
+        self.num_preprocess_workers = max(1, multiprocessing.cpu_count() // 4)
+        self.executor = None
+
+        # repeated paragraphs and sentences skip pysbd and the normalizer across runs
+        cache_dir = self.trans_file.parent if self.trans_file else Path('.')
+        cache_path = TextCachePath if TextCachePath else cache_dir / 'text_cache.db'
+        self.seg_cache = TextCache(cache_path, 'segment')
+        model_id = self.preprocessor.get_model_id()
+        self.pre_cache = TextCache(cache_path, f'preprocess_{src_lang}_{tgt_lang}_{model_id}')
+
+    def save_translations(self):
+        save_trans = [{"mr": k, "en": v} for (k, v) in self.trans.items()]
+
+        # written to a temporary file first, an interrupted save leaves the last one intact
+        tmp_file = self.trans_file.parent / f'{self.trans_file.name}.tmp'
+        with gzip.open(tmp_file, "wb") as f:
+            f.write(bytes(json.dumps(save_trans, ensure_ascii=False), encoding='utf-8'))
+        tmp_file.replace(self.trans_file)
+
+    def save_batch(self, src_texts, trans_texts):
+        # the memory appends only the batch, the json file is rewritten in full
+        if self.trans_memory:
+            self.trans_memory.add(zip(src_texts, trans_texts), self.range_str)
+        else:
+            self.save_translations()
+
+        self.seg_cache.save()
+        self.pre_cache.save()
+        print(self.seg_cache.stats_str())
+        print(self.pre_cache.stats_str())
+
+    def preprocess_sents(self, sents):
+        return self.preprocessor.preprocess_sents(sents)
+
     def postprocess_sents(self, sents):
         def detokenize(text):
             # Remove space before punctuation characters
@@ -147,18 +255,25 @@ class Translator:
         return postprocessed_sents
 
     def model_translate_sents(self, sents):
-        pass
-
-
-    def translate_sents(self, sents):
-        pre_sents = self.preprocess_sents(sents)
+        tokens = [sent.split(" ") for sent in sents]
+        results = self.translator.translate_batch(
+            tokens,
+            max_batch_size=self.sub_batch_size,
+            batch_type="tokens",
+            beam_size=BeamSize,
+            max_input_length=MaxSeqLen,
+            max_decoding_length=MaxSeqLen,
+        )
+        return [" ".join(r.hypotheses[0]) for r in results]
 
+    def model_translate_batches(self, pre_sents):
+        # batches of max_batch_size tokens, returns the translations and the number of tokens
         num_tokens, batch_sents, translations, total_tokens = 0, [], [], 0
         for sent in pre_sents:
             num_sent_tokens = len(sent.strip().split(' '))
-            if num_tokens + num_sent_tokens >= self.max_batch_size-10:
+            if batch_sents and num_tokens + num_sent_tokens >= self.max_batch_size-10:
                 translations += self.model_translate_sents(batch_sents)
-                batch_sents.clear()
+                batch_sents = []
                 total_tokens += num_tokens
                 num_tokens = 0
             batch_sents.append(sent)
@@ -167,66 +282,205 @@ class Translator:
         if batch_sents:
             total_tokens += num_tokens
             translations += self.model_translate_sents(batch_sents)
-        
+        return translations, total_tokens
 
-        trans_sents = self.gpu_translate(sents)
-
-        trans_sents = self.postprocess_sents(sents)
+    def translate_sents(self, sents):
+        """Three stages connected by bounded queues, the chunks of sentences are preprocessed
+        in the worker processes, translated by the model in this thread and postprocessed in
+        a thread, so the next chunk is prepared while the current one is translated.
+        """
+        start = time.perf_counter()
+        chunk_starts = range(0, len(sents), SentChunkSize)
+        sent_chunks = iter([sents[i : i + SentChunkSize] for i in chunk_starts])
+
+        pre_futures = deque()
+
+        def submit_chunk():
+            chunk = next(sent_chunks, None)
+            if chunk is None:
+                return
+
+            # only the sentences missing in the cache are sent to the workers
+            cached = self.pre_cache.get_many(chunk)
+            misses = list(dict.fromkeys(s for s in chunk if s not in cached))
+            future = self.executor.submit(preprocess_sents, misses) if misses else None
+            pre_futures.append((chunk, cached, misses, future))
+
+        post_queue, trans_sents, post_errors = queue.Queue(maxsize=QueueSize), [], []
+
+        def postprocess_worker():
+            while True:
+                translations = post_queue.get()
+                if translations is None:
+                    break
+                try:
+                    trans_sents.extend(self.postprocess_sents(translations))
+                except Exception as e:
+                    post_errors.append(e)
+
+        post_thread = threading.Thread(target=postprocess_worker, daemon=True)
+        post_thread.start()
+
+        for _ in range(QueueSize):
+            submit_chunk()
+
+        total_tokens, wait_secs = 0, 0.0
+        try:
+            while pre_futures:
+                chunk, cached, misses, future = pre_futures.popleft()
+                if future:
+                    wait_start = time.perf_counter()
+                    new_pre_sents = dict(zip(misses, future.result()))
+                    wait_secs += time.perf_counter() - wait_start
+
+                    self.pre_cache.put_many(new_pre_sents.items())
+                    cached.update(new_pre_sents)
+                pre_sents = [cached[s] for s in chunk]
+
+                submit_chunk()
+                translations, num_tokens = self.model_translate_batches(pre_sents)
+                total_tokens += num_tokens
+                post_queue.put(translations)
+        finally:
+            post_queue.put(None)
+            post_thread.join()
+
+        if post_errors:
+            raise post_errors[0]
+        assert len(trans_sents) == len(sents)
+
+        secs = time.perf_counter() - start
+        tokens_per_sec = total_tokens / secs if secs else 0.0
+        print(
+            f"#sents: {len(sents)} #tokens: {total_tokens} time: {secs:.1f}s"
+            f" tokens/sec: {tokens_per_sec:.1f} waiting for preprocessing: {wait_secs:.1f}s"
+        )
         return trans_sents
 
     def translate_paras(self, paras):
         paras = list(paras)
 
+        # only the paragraphs missing in the cache are segmented by the workers
+        para_sents = self.seg_cache.get_many(paras)
+        misses = list(dict.fromkeys(p for p in paras if p not in para_sents))
+
+        miss_chunks = [misses[i : i + ParaChunkSize] for i in range(0, len(misses), ParaChunkSize)]
+        chunk_sents = self.executor.map(segment_paras, miss_chunks)
+        new_para_sents = dict(zip(misses, (ps for chunk in chunk_sents for ps in chunk)))
+
+        self.seg_cache.put_many(new_para_sents.items())
+        para_sents.update(new_para_sents)
+
         sents, partitions = [], [0]
         for para in paras:
-            sents.extend(s.strip() for s in self.seg.segment(para))
+            sents.extend(para_sents[para])
             partitions.append(len(sents))
 
         trans_sents = self.translate_sents(sents)
 
         trans_paras = []
-        for (s, e)in pairwise(partitions):
+        for (s, e) in pairwise(partitions):
             trans_para = " ".join(trans_sents[s:e])
-        trans_paras.append(trans_para)
+            trans_paras.append(trans_para)
         return trans_paras
-        
-    def translate(self):
+
+    def translate(self, trans_queue=None):
+        init_args = (self.ckpt_dir, self.src_lang, self.tgt_lang)
+        with ProcessPoolExecutor(
+            max_workers=self.num_preprocess_workers,
+            initializer=init_preprocessor,
+            initargs=init_args,
+        ) as self.executor:
+            if trans_queue:
+                self.translate_queue(trans_queue)
+            else:
+                self.translate_todos()
+        self.executor = None
+
+    def translate_queue(self, trans_queue):
+        worker_id = f'{socket.gethostname()}:{os.getpid()}'
+        try:
+            while True:
+                leased = trans_queue.lease(worker_id)
+                if not leased:
+                    break
+
+                paras = [t for (t, kind) in leased if kind == 'para']
+                sents = [t for (t, kind) in leased if kind == 'sent']
+                print(f"{worker_id} leased #paras: {len(paras)} #sents: {len(sents)}")
+
+                trans_texts = self.translate_paras(paras) if paras else []
+                trans_texts += self.translate_sents(sents) if sents else []
+                trans_queue.ack(zip(paras + sents, trans_texts))
+
+                self.seg_cache.save()
+                self.pre_cache.save()
+                print(trans_queue.get_state_counts())
+        finally:
+            trans_queue.release(worker_id)
+        print("******** QUEUE DRAINED ***********")
+
+    def translate_todos(self):
         print("******** PARAGRAPHS ***********")
         paras = [p for p in self.todos['paras'] if p not in self.trans]
+        if self.trans_memory:
+            # texts with the same normalized form are translated once across all ranges
+            print(f"Translation memory hits: {self.trans_memory.hit_rate_str()}")
+            paras = unique_texts(paras)
+        print(f"#paras: {len(self.todos['paras'])} #to translate: {len(paras)}")
 
         for start_idx in range(0, len(paras), self.file_batch_size):
-            end_idx = start_idx + self.file_batch_size
-            trans_paras = self.translate_paras(paras[start_idx:end_idx])
-            assert len(paras) == len(trans_paras)
-            
-            for (p, t) in zip(paras, trans_paras):
+            batch_paras = paras[start_idx : start_idx + self.file_batch_size]
+            trans_paras = self.translate_paras(batch_paras)
+            assert len(batch_paras) == len(trans_paras)
+
+            for (p, t) in zip(batch_paras, trans_paras):
                 self.trans[p] = t
-            self.save_translations()
-        
+            self.save_batch(batch_paras, trans_paras)
+            print(f"Saved {start_idx + len(batch_paras)}/{len(paras)} paras")
 
         print("******** SENTS ***********")
         sents = [s for s in self.todos['sents'] if s not in self.trans]
-        trans_sents = self.translate_sents(sents)
+        if self.trans_memory:
+            sents = unique_texts(sents)
+        print(f"#sents: {len(self.todos['sents'])} #to translate: {len(sents)}")
 
-        for (s, t) in zip(sents, trans_sents):
-            self.trans[s] = t
-        self.save_translations()
+        for start_idx in range(0, len(sents), self.file_batch_size):
+            batch_sents = sents[start_idx : start_idx + self.file_batch_size]
+            trans_sents = self.translate_sents(batch_sents)
+
+            for (s, t) in zip(batch_sents, trans_sents):
+                self.trans[s] = t
+            self.save_batch(batch_sents, trans_sents)
         print("******** DONE ***********")
 
 
 def main():
-    input_dir = Path(sys.argv[1])
-    output_dir = Path(sys.argv[2])
-
     if len(sys.argv) != 3:
-        print("Usage: {sys.argv[0]} <input_dir> <output_dir>")
-        print("\tinput_dir contains doc_translations_todo.json")
+        print(f"Usage: {sys.argv[0]} <input_dir> <output_dir>")
+        print("\tinput_dir contains todos-{range}.json")
         sys.exit(1)
 
+    input_dir = Path(sys.argv[1])
+    output_dir = Path(sys.argv[2])
+
     todo_files = input_dir.glob('todos-*.json*')
 
+    # the workers share the queue, the translations are merged with trans_queue.py export
+    if TransQueuePath:
+        trans_queue = TransQueue(TransQueuePath)
+        for todo_file in todo_files:
+            trans_queue.add_todo_file(todo_file)
+
+        translator = Translator(None, None, "mar_Deva", "eng_Latn")
+        translator.translate(trans_queue)
+        trans_queue.close()
+        return
+
     for todo_file in todo_files:
-        trans_file = output_dir / todo_file.name.replace('todos', 'trans')
+        trans_name = todo_file.name.replace('todos', 'trans')
+        trans_name = trans_name if trans_name.endswith('.gz') else f'{trans_name}.gz'
+        trans_file = output_dir / trans_name
         translator = Translator(trans_file, todo_file, "mar_Deva", "eng_Latn")
         translator.translate()
 
@@ -0,0 +1,126 @@
+import hashlib
+import inspect
+import json
+from pathlib import Path
+
+from docint.doc import Doc
+
+ChunkSize = 1024 * 1024
+
+
+def source_hash(proc):
+    try:
+        source_file = Path(inspect.getsourcefile(type(proc)))
+        return hashlib.sha256(source_file.read_bytes()).hexdigest()
+    except (TypeError, OSError):
+        return ''
+
+
+class CheckpointPipeline:
+    """Runs the stages of a docint pipeline one document at a time, the output doc of the
+    stages marked with `checkpoint: True` in the pipeline config is saved to the checkpoint_dir.
+
+    The snapshot is keyed by the stage name and a hash of the config and source of that stage
+    and all the stages before it, along with the per document conf files. A run can resume from
+    any stage using the snapshot of the nearest checkpointed stage before it.
+    """
+
+    def __init__(self, viz, pipeline_config, checkpoint_dir, conf_dir='conf'):
+        self.viz = viz
+        self.stages = list(viz.pipeline)
+        self.stage_names = [name for (name, _) in self.stages]
+
+        self.checkpoint_dir = Path(checkpoint_dir)
+        self.conf_dir = Path(conf_dir)
+
+        self.checkpoint_stages = set(c['name'] for c in pipeline_config if c.get('checkpoint'))
+        self.stage_hashes = self.get_stage_hashes(pipeline_config)
+
+        if self.checkpoint_stages:
+            self.checkpoint_dir.mkdir(parents=True, exist_ok=True)
+
+    def get_stage_hashes(self, pipeline_config):
+        configs = dict((c['name'], c.get('config', {})) for c in pipeline_config)
+
+        h, stage_hashes = hashlib.sha256(), []
+        for (name, proc) in self.stages:
+            config_str = json.dumps(configs.get(name, {}), sort_keys=True, default=str)
+            h.update(f'{name}:{config_str}:{source_hash(proc)}\n'.encode('utf-8'))
+            stage_hashes.append(h.hexdigest())
+        return stage_hashes
+
+    def get_doc_hash(self, pdf_path):
+        h = hashlib.sha256()
+        h.update(f'{pdf_path.name}:'.encode('utf-8'))
+        with open(pdf_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(ChunkSize), b''):
+                h.update(chunk)
+        for conf_file in sorted(self.conf_dir.glob(f'{pdf_path.name}.*.yml')):
+            h.update(conf_file.name.encode('utf-8'))
+            h.update(conf_file.read_bytes())
+        return h.hexdigest()
+
+    def get_snapshot_path(self, pdf_path, doc_hash, stage_idx):
+        stage_name = self.stage_names[stage_idx]
+        key = hashlib.sha256(f'{self.stage_hashes[stage_idx]}:{doc_hash}'.encode('utf-8'))
+        key_str = key.hexdigest()[:16]
+        return self.checkpoint_dir / f'{pdf_path.name}.{stage_name}.{key_str}.doc.json.gz'
+
+    def save_snapshot(self, doc, snapshot_path):
+        stage_stub = snapshot_path.name.rsplit('.', 4)[0]
+        for old_path in self.checkpoint_dir.glob(f'{stage_stub}.*.doc.json.gz'):
+            old_path.unlink()
+        doc.to_disk(snapshot_path)
+
+    def load_snapshot(self, pdf_path, doc_hash, from_stage):
+        from_idx = self.stage_names.index(from_stage)
+        for stage_idx in range(from_idx - 1, -1, -1):
+            if self.stage_names[stage_idx] not in self.checkpoint_stages:
+                continue
+
+            snapshot_path = self.get_snapshot_path(pdf_path, doc_hash, stage_idx)
+            if snapshot_path.exists():
+                print(f'Resuming {pdf_path.name} from {snapshot_path.name}')
+                return Doc.from_disk(snapshot_path), stage_idx + 1
+
+        print(f'No checkpoint before {from_stage} for {pdf_path.name}, running all stages')
+        return None, 0
+
+    def __call__(self, pdf_path, from_stage=None):
+        pdf_path = Path(pdf_path)
+        doc_hash = self.get_doc_hash(pdf_path)
+
+        doc, start_idx = None, 0
+        if from_stage:
+            doc, start_idx = self.load_snapshot(pdf_path, doc_hash, from_stage)
+
+        if doc is None:
+            doc = self.viz.build_doc(pdf_path)
+
+        for stage_idx in range(start_idx, len(self.stages)):
+            name, proc = self.stages[stage_idx]
+            doc = proc(doc)
+            if name in self.checkpoint_stages:
+                self.save_snapshot(doc, self.get_snapshot_path(pdf_path, doc_hash, stage_idx))
+        return doc
+
+    def save_snapshots(self, docs, stage_idx, pdf_paths, doc_hashes):
+        for doc in docs:
+            pdf_path = pdf_paths[doc.pdf_name]
+            snapshot_path = self.get_snapshot_path(pdf_path, doc_hashes[doc.pdf_name], stage_idx)
+            self.save_snapshot(doc, snapshot_path)
+            yield doc
+
+    def pipe_all(self, pdf_paths):
+        """Streams all the documents through the stages as Vision.pipe_all does, stages with a
+        pipe method get the whole stream, and saves the checkpoints on the way.
+        """
+        pdf_paths = dict((p.name, p) for p in (Path(p) for p in pdf_paths))
+        doc_hashes = dict((n, self.get_doc_hash(p)) for (n, p) in pdf_paths.items())
+
+        docs = (self.viz.build_doc(p) for p in pdf_paths.values())
+        for (stage_idx, (name, proc)) in enumerate(self.stages):
+            docs = proc.pipe(docs) if hasattr(proc, 'pipe') else map(proc, docs)
+            if name in self.checkpoint_stages:
+                docs = self.save_snapshots(docs, stage_idx, pdf_paths, doc_hashes)
+        return docs
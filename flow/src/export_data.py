@@ -1,13 +1,28 @@
+import argparse
 import csv
+import datetime
+import filecmp
 import gzip
+import heapq
 import json
+import re
 import shutil
-import sys
+import tempfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from operator import itemgetter
-from itertools import groupby
+from itertools import islice
 
 from pathlib import Path
 
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa, pq = None, None
+
+from build_manifest import FileHashes
+from export_sqlite import SqliteExport
+
 Fields = ['session', 'year', 'house', 'doc_type', 'date', 'list_num']
 
 def get_info(qna_en_file):
@@ -22,7 +37,10 @@ def get_info(qna_en_file):
 
 ExportDir = Path('/Users/mukund/orgpedia/mahmls/export/orgpedia_mahmls/')
 
-def export_document(mr_txt_file):
+def read_document(mr_txt_file):
+    """Returns the export path of the marathi text and the en, mr questions of the document,
+    the export path is None for documents that are not questions.
+    """
     doc_name = mr_txt_file.name.replace('.mr.txt.gz', '')
     
     qna_en_file = mr_txt_file.parent / f'{doc_name}.qna.en.json.gz'    
@@ -32,7 +50,7 @@ def export_document(mr_txt_file):
     session, year, house, doc_type, doc_date, list_num = en_field_vals
 
     if doc_type not in ('StarredQuestions', 'UnstarredQuestions'):
-        return [], []
+        return None, [], []
 
     with gzip.open(qna_en_file, "rb") as f:
         en_questions = json.loads(f.read())
@@ -40,7 +58,6 @@ def export_document(mr_txt_file):
             for (f, v) in zip(Fields, en_field_vals):
                 question.setdefault(f, v)
             question['year'] = int(question['year'])
-            question['names'] = '-'.join(question['names'])
         
 
     mr_field_vals = get_info(qna_mr_file)
@@ -50,7 +67,6 @@ def export_document(mr_txt_file):
             for (f, v) in zip(Fields, mr_field_vals):
                 question.setdefault(f, v)
             question['year'] = int(question['year'])
-            question['names'] = '-'.join(question['names'])            
     
     stub = ''
     if doc_type in ('StarredQuestions', 'UnstarredQuestions'):
@@ -58,77 +74,536 @@ def export_document(mr_txt_file):
 
     doc_name = f'{year}-{session}-{house}-{doc_type}{stub}.mr.txt.gz'
     ex_mr_file = ExportDir / Path(f'{doc_type}-docs') / doc_name
-    
-    ex_mr_file.parent.mkdir(exist_ok=True)
+    return ex_mr_file, en_questions, mr_questions
 
-    print(f'Copying to {ex_mr_file.name}')
 
+def copy_document(mr_txt_file, ex_mr_file):
+    # skip the copy if the exported file has the same content
+    if ex_mr_file.exists() and filecmp.cmp(mr_txt_file, ex_mr_file, shallow=False):
+        return
+
+    ex_mr_file.parent.mkdir(exist_ok=True)
+    print(f'Copying to {ex_mr_file.name}')
     shutil.copyfile(mr_txt_file, ex_mr_file)
 
-    # Get questions
-    return en_questions, mr_questions
+def join_names(question):
+    # the csv and json files have the names joined with '-', the parquet and sqlite get the list
+    return dict(question, names='-'.join(question['names']))
+
+
+def to_csv_row(question, schema, fields):
+    question = join_names(question)
+    return dict((s, question.get(k, '')) for (s, k) in zip(schema, fields))
+
 
 def write_csv_file(csv_file_name, questions, schema, fields):
     with gzip.open((ExportDir / Path('Questions') / csv_file_name), 'wt') as questions_csv:
         csv_writer = csv.DictWriter(questions_csv, fieldnames=schema)
         csv_writer.writeheader()
-        rows = [dict((s, q.get(k, '')) for (s, k) in zip(schema, fields)) for q in questions]
-        csv_writer.writerows(rows)
+        for question in questions:
+            csv_writer.writerow(to_csv_row(question, schema, fields))
+
 
 def write_json_file(json_file_name, questions):
+    # same bytes as json.dumps(questions), written one question at a time
     with gzip.open((ExportDir / Path('Questions') / json_file_name), 'wb') as f:
-        f.write(bytes(json.dumps(questions), encoding='utf-8'))
+        f.write(b'[')
+        for (idx, question) in enumerate(questions):
+            if idx:
+                f.write(b', ')
+            f.write(bytes(json.dumps(join_names(question)), encoding='utf-8'))
+        f.write(b']')
+
+
+SampleSize = 10
+
 
 def write_sample_csv_file(csv_file_name, questions, schema, fields):
     with open(ExportDir / csv_file_name, 'w') as questions_csv:
         csv_writer = csv.DictWriter(questions_csv, fieldnames=schema)
         csv_writer.writeheader()
-        rows = [dict((s, q.get(k, '')) for (s, k) in zip(schema, fields)) for q in questions[:10]]
+        rows = [to_csv_row(q, schema, fields) for q in questions[:SampleSize]]
         csv_writer.writerows(rows)
 
+
 def write_sample_json_file(json_file_name, questions):
     with open((ExportDir / json_file_name), 'w') as f:
-        f.write(json.dumps(questions[:10], indent=2, ensure_ascii=False))
+        sample_questions = [join_names(q) for q in questions[:SampleSize]]
+        f.write(json.dumps(sample_questions, indent=2, ensure_ascii=False))
 
-def main():
-    en_all_questions, mr_all_questions = [], []
-    for doc_dir in sys.argv[1:]:
-        doc_dir = Path(doc_dir)
-        output_dir = doc_dir / "output"
 
-        doc_files = output_dir.glob('*.mr.txt.gz')
+# number of questions sorted in memory at a time, larger years are merged from sorted runs
+RunSize = 50000
+
+
+class YearSpill:
+    """Spills the questions of each year to a jsonl file in spill_dir, the questions of a year
+    are read back sorted on name with an external merge sort.
+    """
+
+    def __init__(self, spill_dir, lang):
+        self.spill_dir = Path(spill_dir)
+        self.lang = lang
+        self.year_files = {}
+
+    def add(self, questions):
+        for question in questions:
+            year = question['year']
+            if year not in self.year_files:
+                spill_path = self.spill_dir / f'{self.lang}-{year}.jsonl'
+                self.year_files[year] = open(spill_path, 'w', encoding='utf-8')
+            self.year_files[year].write(json.dumps(question) + '\n')
+
+    def close(self):
+        for year_file in self.year_files.values():
+            year_file.close()
+
+    def write_runs(self, year):
+        spill_path = self.spill_dir / f'{self.lang}-{year}.jsonl'
+        run_paths = []
+        with open(spill_path, encoding='utf-8') as spill_file:
+            while True:
+                run = [json.loads(line) for line in islice(spill_file, RunSize)]
+                if not run:
+                    break
+                run.sort(key=itemgetter('name'))  # stable, ties stay in the spill order
+
+                run_path = self.spill_dir / f'{self.lang}-{year}.run{len(run_paths)}.jsonl'
+                with open(run_path, 'w', encoding='utf-8') as run_file:
+                    run_file.writelines(json.dumps(q) + '\n' for q in run)
+                run_paths.append(run_path)
+        spill_path.unlink()
+        return run_paths
+
+    def iter_runs(self, run_paths):
+        run_files = [open(p, encoding='utf-8') for p in run_paths]
+        try:
+            runs = [map(json.loads, f) for f in run_files]
+            # heapq.merge prefers the earlier run on ties, this keeps the sort stable
+            yield from heapq.merge(*runs, key=itemgetter('name'))
+        finally:
+            for run_file in run_files:
+                run_file.close()
+
+    def iter_years(self):
+        # yields (year, run_paths), the sorted questions are read with iter_runs(run_paths)
+        for year in sorted(self.year_files):
+            run_paths = self.write_runs(year)
+            yield year, run_paths
+            for run_path in run_paths:
+                run_path.unlink()
+
+
+# column types of the parquet and sqlite exports follow question_answer.info.md, except
+# year which is an integer
+ParquetTypes = {
+    'title': 'string',
+    'question_num': 'integer',
+    'long_num': 'integer',
+    'names': 'array',
+    'role': 'string',
+    'question_date': 'date',
+    'question': 'string',
+    'minister_name': 'string',
+    'answer_date': 'date',
+    'answer': 'string',
+    'house': 'string',
+    'doc_type': 'string',
+    'session': 'string',
+    'year': 'integer',
+    'url': 'string',
+    'name': 'string',
+    'date': 'string',
+    'list_num': 'string',
+}
+
+# low cardinality columns are dictionary encoded
+DictionaryFields = ('house', 'doc_type', 'session', 'role', 'minister_name')
+
+ParquetBatchSize = 10000
+
+DatePattern = re.compile(r'(\d+)\s*[-./]\s*(\d+)\s*[-./]\s*(\d+)')
+
+
+def to_int(val):
+    # isdecimal() and int() also handle devanagari digits
+    if isinstance(val, int) or val is None:
+        return val
+    val = str(val).strip()
+    return int(val) if val.isdecimal() else None
+
+
+def to_date(val):
+    m = DatePattern.search(str(val or ''))
+    if not m:
+        return None
+
+    nums = [int(g) for g in m.groups()]
+    year, month, day = nums if len(m.group(1)) == 4 else nums[::-1]
+    year = year + 2000 if year < 100 else year
+    try:
+        return datetime.date(year, month, day)
+    except ValueError:
+        return None
+
+
+def to_typed_row(question):
+    row = {}
+    for (field, field_type) in ParquetTypes.items():
+        val = question.get(field, None)
+        if field_type == 'integer':
+            val = to_int(val)
+        elif field_type == 'date':
+            val = to_date(val)
+        elif field_type == 'array':
+            val = [n.strip() for n in (val or []) if n.strip()]
+        elif val is not None:
+            val = str(val)
+        row[field] = val
+    return row
+
+
+def get_parquet_schema():
+    arrow_types = {
+        'string': pa.string(),
+        'integer': pa.int64(),
+        'date': pa.date32(),
+        'array': pa.list_(pa.string()),
+    }
+    fields = []
+    for (field, field_type) in ParquetTypes.items():
+        if field in DictionaryFields:
+            fields.append(pa.field(field, pa.dictionary(pa.int32(), pa.string())))
+        else:
+            fields.append(pa.field(field, arrow_types[field_type]))
+    return pa.schema(fields)
+
+
+def write_parquet_file(parquet_file_name, questions):
+    parquet_path = ExportDir / Path('Parquet') / parquet_file_name
+    parquet_path.parent.mkdir(parents=True, exist_ok=True)
+
+    schema = get_parquet_schema()
+    rows = map(to_typed_row, questions)
+    with pq.ParquetWriter(parquet_path, schema, compression='zstd') as writer:
+        while True:
+            batch = list(islice(rows, ParquetBatchSize))
+            if not batch:
+                break
+            writer.write_table(pa.Table.from_pylist(batch, schema=schema))
+
+
+SqliteFile = 'mahmls.sqlite'
+
+
+def update_sqlite(doc_dirs, year_docs, export_years):
+    sqlite_export = SqliteExport(ExportDir / SqliteFile)
+
+    infos = []
+    for doc_dir in doc_dirs:
+        documents_file = doc_dir / 'conf' / 'documents.json'
+        if documents_file.exists():
+            infos += json.loads(documents_file.read_text())
+    sqlite_export.update_documents(infos)
+
+    removed_years = set(sqlite_export.get_years()) - set(year_docs)
+    sqlite_export.delete_years(sorted(removed_years | set(export_years)))
+
+    for year in export_years:
+        print(f'Adding {year} to {SqliteFile}')
+        for doc_file in year_docs[year]:
+            _, en_questions, mr_questions = read_document(Path(doc_file))
+            for (lang, questions) in [('en', en_questions), ('mr', mr_questions)]:
+                rows = (to_typed_row(q) for q in questions if q['year'] == year)
+                sqlite_export.add_questions(lang, rows)
+    sqlite_export.close()
+
+
+def update_datapackage(langs):
+    """Adds a resource for the parquet files of each lang to datapackage.json."""
+    datapackage_path = ExportDir / 'datapackage.json'
+    if not datapackage_path.exists():
+        datapackage = {'name': 'orgpedia_mahmls', 'resources': []}
+    else:
+        try:
+            datapackage = json.loads(datapackage_path.read_text())
+        except ValueError:
+            # a hand written file is kept, the parquet resources have to be added to it
+            print(f'Not updating {datapackage_path}, it is not a json file')
+            return
+
+    table_schema = {
+        'fields': [{'name': f, 'type': t} for (f, t) in ParquetTypes.items()],
+    }
+
+    resources = datapackage.setdefault('resources', [])
+    for lang in langs:
+        resource_name = f'question_answer_{lang}_parquet'
+        parquet_dir = ExportDir / 'Parquet' / f'question_answer_{lang}'
+        parquet_paths = sorted(p.relative_to(ExportDir) for p in parquet_dir.glob('*.parquet'))
+
+        resource = {
+            'name': resource_name,
+            'path': [str(p) for p in parquet_paths],
+            'format': 'parquet',
+            'mediatype': 'application/vnd.apache.parquet',
+            'schema': table_schema,
+        }
+        resource_names = [r.get('name') for r in resources]
+        if resource_name in resource_names:
+            resources[resource_names.index(resource_name)] = resource
+        else:
+            resources.append(resource)
+
+    datapackage_path.write_text(json.dumps(datapackage, indent=2, ensure_ascii=False) + '\n')
+
+
+def export_lang(year_spill, lang, schema, fields, parquet=False):
+    """Writes the year files of the questions in year_spill, returns the first SampleSize
+    questions in (year, name) order for the sample files.
+    """
+    sample_questions = []
+    for (year, run_paths) in year_spill.iter_years():
+        num_sample = SampleSize - len(sample_questions)
+        if num_sample > 0:
+            sample_questions += islice(year_spill.iter_runs(run_paths), num_sample)
+
+        year_stub = f'{year}-question_answer_{lang}'
+        write_csv_file(f'{year_stub}.csv.gz', year_spill.iter_runs(run_paths), schema, fields)
+        write_json_file(f'{year_stub}.json.gz', year_spill.iter_runs(run_paths))
+        if parquet:
+            parquet_file_name = f'question_answer_{lang}/{year}.parquet'
+            write_parquet_file(parquet_file_name, year_spill.iter_runs(run_paths))
+    return sample_questions
+
+
+def write_samples(lang, schema, fields, sample_questions):
+    sample_csv_file = f'question_answer_{lang}_sample.csv'
+    write_sample_csv_file(sample_csv_file, sample_questions, schema, fields)
+    write_sample_json_file(f'question_answer_{lang}_sample.json', sample_questions)
+
+
+EnFields = ['title', 'question_num', 'long_num', 'names', 'role', 'question_date', 'question',
+            'minister_name', 'answer_date', 'answer', 'house', 'doc_type', 'session', 'year',
+            'url', 'name', 'date', 'list_num' ]
+
+MrFields = ['शीर्षक', 'प्रश्न_क्रमांक', 'लांब संख्या', 'नावे', 'मंत्रीपद', 'प्रश्न तारीख', 'प्रश्न',
+            'मंत्री नाव', 'उत्तर तारीख', 'उत्तर', 'सभागृह', 'दस्तऐवज_प्रकार',
+            'सत्र', 'वर्ष', 'संकेत स्थळ', 'नाव', 'तारीख', 'यादी_क्रमांक']
+
+
+def export_year(year, doc_files, parquet):
+    """Writes the year files of the questions of year from doc_files (in scan order), returns
+    the year and the first questions of each lang for the sample files.
+    """
+    with tempfile.TemporaryDirectory(prefix=f'export_data-{year}-') as spill_dir:
+        en_spill, mr_spill = YearSpill(spill_dir, 'en'), YearSpill(spill_dir, 'mr')
         for doc_file in doc_files:
-            #doc_file = Path(output_dir / 'mahmls-252.pdf.mr.txt.gz')
-            (en_questions, mr_questions) = export_document(doc_file)
-            en_all_questions += en_questions
-            mr_all_questions += mr_questions
-    #end
+            _, en_questions, mr_questions = read_document(Path(doc_file))
+            en_spill.add(q for q in en_questions if q['year'] == year)
+            mr_spill.add(q for q in mr_questions if q['year'] == year)
+        en_spill.close()
+        mr_spill.close()
 
-    en_fields = ['title', 'question_num', 'long_num', 'names', 'role', 'question_date', 'question',
-                 'minister_name', 'answer_date', 'answer', 'house', 'doc_type', 'session', 'year',
-                 'url', 'name', 'date', 'list_num' ]
+        en_sample = export_lang(en_spill, 'en', EnFields, EnFields, parquet)
+        mr_sample = export_lang(mr_spill, 'mr', MrFields, EnFields, parquet)
+    return year, {'en': en_sample, 'mr': mr_sample}
 
-    mr_fields = ['शीर्षक', 'प्रश्न_क्रमांक', 'लांब संख्या', 'नावे', 'मंत्रीपद', 'प्रश्न तारीख', 'प्रश्न',
-                 'मंत्री नाव', 'उत्तर तारीख', 'उत्तर', 'सभागृह', 'दस्तऐवज_प्रकार',
-                 'सत्र', 'वर्ष', 'संकेत स्थळ', 'नाव', 'तारीख', 'यादी_क्रमांक']
 
-    
-    en_all_questions.sort(key=lambda q: (q['year'], q['name']))
-    for (year, year_questions) in groupby(en_all_questions, key=itemgetter('year')):
-        year_questions = list(year_questions)
-        write_csv_file(f'{year}-question_answer_en.csv.gz', year_questions, en_fields, en_fields)
-        write_json_file(f'{year}-question_answer_en.json.gz', year_questions)
-
-    write_sample_csv_file('question_answer_en_sample.csv', en_all_questions, en_fields, en_fields)
-    write_sample_json_file('question_answer_en_sample.json', en_all_questions)    
-        
-    mr_all_questions.sort(key=lambda q: (q['year'], q['name']))    
-    for (year, year_questions) in groupby(mr_all_questions, key=itemgetter('year')):
-        year_questions = list(year_questions)        
-        write_csv_file(f'{year}-question_answer_mr.csv.gz', year_questions, mr_fields, en_fields)
-        write_json_file(f'{year}-question_answer_mr.json.gz', year_questions)
+def get_sample_years(year_counts):
+    # the samples are the first questions in (year, name) order, they can span a few years
+    sample_years, num_questions = [], 0
+    for year in sorted(year_counts):
+        if num_questions >= SampleSize:
+            break
+        sample_years.append(year)
+        num_questions += year_counts[year]
+    return sample_years
+
+
+class ExportManifest(FileHashes):
+    """Records per source document the hash of its files and the years of its questions, only
+    the years with a changed, added or removed document are exported again.
+    """
+
+    def __init__(self, manifest_file, source_files):
+        self.manifest_file = Path(manifest_file)
+        if self.manifest_file.exists() and self.manifest_file.stat().st_size:
+            manifest = json.loads(self.manifest_file.read_text())
+        else:
+            manifest = {}
+
+        self.docs = manifest.get('docs', {})
+        self.sample_years = manifest.get('sample_years', None)
+        self.options = manifest.get('options', {})
+        super().__init__(manifest.get('file_stats', {}))
+
+        self.source_hash = self.hash_files(Path(f) for f in source_files)
+        self.source_changed = manifest.get('source_hash', None) != self.source_hash
+
+    def doc_hash(self, mr_txt_file):
+        doc_name = mr_txt_file.name.replace('.mr.txt.gz', '')
+        qna_files = [mr_txt_file.parent / f'{doc_name}.qna.{lang}.json.gz' for lang in ('en', 'mr')]
+        return self.hash_files([mr_txt_file] + qna_files)
+
+    def save(self, docs, sample_years, options):
+        manifest = {
+            'docs': docs,
+            'sample_years': sample_years,
+            'options': options,
+            'source_hash': self.source_hash,
+            'file_stats': self.file_stats,
+        }
+        self.manifest_file.write_text(json.dumps(manifest, indent=2, sort_keys=True))
+
+
+def scan_documents(manifest, doc_files, force):
+    """Returns the manifest entries of doc_files and the years that have to be exported, the
+    marathi text of new and changed documents is copied to the export directory.
+    """
+    docs, changed_years = {}, set()
+    for doc_file in doc_files:
+        doc_hash = manifest.doc_hash(doc_file)
+        old_entry = manifest.docs.get(str(doc_file), None)
+
+        unchanged = old_entry and old_entry['hash'] == doc_hash and 'export_file' in old_entry
+        if unchanged and not force:
+            docs[str(doc_file)] = old_entry
+
+            # the exported copy was deleted
+            ex_mr_file = old_entry['export_file']
+            if ex_mr_file and not Path(ex_mr_file).exists():
+                copy_document(doc_file, Path(ex_mr_file))
+            continue
+
+        ex_mr_file, en_questions, mr_questions = read_document(doc_file)
+        years = sorted(set(q['year'] for q in en_questions + mr_questions))
+
+        # questions per year, the samples need the counts of the years without reading them
+        counts = [
+            min(sum(q['year'] == y for q in qs) for qs in (en_questions, mr_questions))
+            for y in years
+        ]
+        docs[str(doc_file)] = {
+            'hash': doc_hash,
+            'years': years,
+            'counts': counts,
+            'export_file': str(ex_mr_file) if ex_mr_file else None,
+        }
+
+        changed_years.update(years)
+        if old_entry:
+            changed_years.update(old_entry['years'])
+
+        if ex_mr_file:
+            copy_document(doc_file, ex_mr_file)
+
+    for (doc_file, old_entry) in manifest.docs.items():
+        if doc_file not in docs:
+            changed_years.update(old_entry['years'])
+
+    return docs, changed_years
+
+
+def get_year_paths(year, parquet):
+    paths = []
+    for lang in ('en', 'mr'):
+        year_stub = f'{year}-question_answer_{lang}'
+        paths += [ExportDir / 'Questions' / f'{year_stub}.{ext}' for ext in ('csv.gz', 'json.gz')]
+        if parquet:
+            paths.append(ExportDir / 'Parquet' / f'question_answer_{lang}' / f'{year}.parquet')
+    return paths
+
+
+def get_sample_paths():
+    paths = []
+    for lang in ('en', 'mr'):
+        paths += [ExportDir / f'question_answer_{lang}_sample.{ext}' for ext in ('csv', 'json')]
+    return paths
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Export the questions and answers by year.')
+    parser.add_argument('doc_dirs', nargs='+', type=Path, help='flow dirs with output dir')
+    parser.add_argument('-m', '--manifest', type=Path, default=Path('export_manifest.json'))
+    parser.add_argument('-w', '--workers', type=int, default=0, help='0 runs in process')
+    parser.add_argument('-f', '--force', action='store_true', help='export all the years')
+    parser.add_argument('-p', '--parquet', action='store_true', help='also export parquet')
+    parser.add_argument('-s', '--sqlite', action='store_true', help=f'also export {SqliteFile}')
+    args = parser.parse_args()
+
+    if args.parquet and pa is None:
+        raise ValueError('--parquet needs pyarrow, install the export dependency group')
+
+    # the years are exported again if the outputs asked for have changed
+    options = {'parquet': args.parquet, 'sqlite': args.sqlite}
+
+    source_files = [Path(__file__), Path(__file__).parent / 'export_sqlite.py']
+    manifest = ExportManifest(args.manifest, source_files)
+    force = args.force or manifest.source_changed or manifest.options != options
+    if args.sqlite and not (ExportDir / SqliteFile).exists():
+        force = True
+
+    doc_files = [f for d in args.doc_dirs for f in (d / 'output').glob('*.mr.txt.gz')]
+    docs, changed_years = scan_documents(manifest, doc_files, force)
+
+    year_docs, year_counts = {}, {}
+    for doc_file in doc_files:
+        doc_entry = docs[str(doc_file)]
+        for (year, count) in zip(doc_entry['years'], doc_entry['counts']):
+            year_docs.setdefault(year, []).append(str(doc_file))
+            year_counts[year] = year_counts.get(year, 0) + count
+
+    # years without documents now, their files are removed
+    old_years = set(y for doc_entry in manifest.docs.values() for y in doc_entry['years'])
+    for year in sorted(old_years - set(year_docs)):
+        print(f'Removing {year}')
+        for year_path in get_year_paths(year, parquet=True):
+            year_path.unlink(missing_ok=True)
+
+    # years whose files were deleted are exported again
+    changed_years.update(
+        y for y in year_docs if not all(p.exists() for p in get_year_paths(y, args.parquet))
+    )
+
+    # the samples are written from the exported sample years, all of them are exported together
+    sample_years = get_sample_years(year_counts)
+    if force:
+        changed_years = set(year_docs)
+    elif sample_years != manifest.sample_years or changed_years & set(sample_years):
+        changed_years.update(sample_years)
+    elif not all(p.exists() for p in get_sample_paths()):
+        changed_years.update(sample_years)
+
+    export_years = sorted(y for y in changed_years if y in year_docs)
+    print(f'Exporting years: {export_years} of {len(year_docs)} years')
+
+    year_samples = {}
+    year_args = [(y, year_docs[y], args.parquet) for y in export_years]
+    if args.workers > 0:
+        with ProcessPoolExecutor(max_workers=args.workers) as executor:
+            futures = [executor.submit(export_year, *a) for a in year_args]
+            for future in as_completed(futures):
+                year, year_samples[year] = future.result()
+                print(f'Exported {year}')
+    else:
+        for year_arg in year_args:
+            year, year_samples[year] = export_year(*year_arg)
+            print(f'Exported {year}')
+
+    if sample_years and all(y in year_samples for y in sample_years):
+        for (lang, schema) in [('en', EnFields), ('mr', MrFields)]:
+            sample_questions = [q for y in sample_years for q in year_samples[y][lang]]
+            write_samples(lang, schema, EnFields, sample_questions)
+
+    if args.sqlite:
+        update_sqlite(args.doc_dirs, year_docs, export_years)
+
+    if args.parquet:
+        update_datapackage(['en', 'mr'])
+
+    manifest.save(docs, sample_years, options)
 
-    write_sample_csv_file('question_answer_mr_sample.csv', mr_all_questions, mr_fields, en_fields)
-    write_sample_json_file('question_answer_mr_sample.json', mr_all_questions)        
 
-main()
+if __name__ == '__main__':
+    main()
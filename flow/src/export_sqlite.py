@@ -0,0 +1,208 @@
+import re
+import sqlite3
+
+# unicode61 splits words on combining marks by default, the matras, virama and nukta of
+# devanagari are marks (Mn, Mc), they are kept as token characters so words stay whole.
+Tokenizer = "unicode61 remove_diacritics 0 categories 'L* N* Co Mc Mn'"
+
+SchemaSQL = f'''
+CREATE TABLE IF NOT EXISTS documents (
+    name TEXT PRIMARY KEY,
+    house TEXT,
+    doc_type TEXT,
+    session TEXT,
+    year INTEGER,
+    date TEXT,
+    list_num TEXT,
+    url TEXT
+);
+
+CREATE TABLE IF NOT EXISTS ministers (
+    id INTEGER PRIMARY KEY,
+    lang TEXT NOT NULL,
+    name TEXT NOT NULL,
+    UNIQUE (lang, name)
+);
+
+CREATE TABLE IF NOT EXISTS names (
+    id INTEGER PRIMARY KEY,
+    lang TEXT NOT NULL,
+    name TEXT NOT NULL,
+    UNIQUE (lang, name)
+);
+
+CREATE TABLE IF NOT EXISTS questions (
+    id INTEGER PRIMARY KEY,
+    lang TEXT NOT NULL,
+    name TEXT NOT NULL,
+    year INTEGER NOT NULL,
+    question_num INTEGER,
+    long_num INTEGER,
+    title TEXT,
+    role TEXT,
+    minister_id INTEGER REFERENCES ministers (id),
+    question_date TEXT,
+    answer_date TEXT,
+    question TEXT,
+    answer TEXT,
+    house TEXT,
+    doc_type TEXT,
+    session TEXT
+);
+CREATE INDEX IF NOT EXISTS questions_name ON questions (name);
+CREATE INDEX IF NOT EXISTS questions_year ON questions (year);
+CREATE INDEX IF NOT EXISTS questions_minister ON questions (minister_id);
+
+CREATE TABLE IF NOT EXISTS question_names (
+    question_id INTEGER NOT NULL REFERENCES questions (id) ON DELETE CASCADE,
+    name_id INTEGER NOT NULL REFERENCES names (id),
+    PRIMARY KEY (question_id, name_id)
+);
+CREATE INDEX IF NOT EXISTS question_names_name ON question_names (name_id);
+
+CREATE TABLE IF NOT EXISTS sub_questions (
+    question_id INTEGER NOT NULL REFERENCES questions (id) ON DELETE CASCADE,
+    num INTEGER,
+    text TEXT
+);
+CREATE INDEX IF NOT EXISTS sub_questions_question ON sub_questions (question_id);
+
+CREATE TABLE IF NOT EXISTS sub_answers (
+    question_id INTEGER NOT NULL REFERENCES questions (id) ON DELETE CASCADE,
+    num INTEGER,
+    text TEXT
+);
+CREATE INDEX IF NOT EXISTS sub_answers_question ON sub_answers (question_id);
+
+CREATE VIRTUAL TABLE IF NOT EXISTS questions_fts USING fts5(
+    title, question, answer, content='questions', content_rowid='id', tokenize="{Tokenizer}"
+);
+
+CREATE TRIGGER IF NOT EXISTS questions_ai AFTER INSERT ON questions BEGIN
+    INSERT INTO questions_fts (rowid, title, question, answer)
+    VALUES (new.id, new.title, new.question, new.answer);
+END;
+
+CREATE TRIGGER IF NOT EXISTS questions_ad AFTER DELETE ON questions BEGIN
+    INSERT INTO questions_fts (questions_fts, rowid, title, question, answer)
+    VALUES ('delete', old.id, old.title, old.question, old.answer);
+END;
+'''
+
+QuestionFields = [
+    'lang',
+    'name',
+    'year',
+    'question_num',
+    'long_num',
+    'title',
+    'role',
+    'minister_id',
+    'question_date',
+    'answer_date',
+    'question',
+    'answer',
+    'house',
+    'doc_type',
+    'session',
+]
+
+DocumentFields = ['name', 'house', 'doc_type', 'session', 'year', 'date', 'list_num', 'url']
+
+# (1), (१) at the start or after a space, marks the sub questions and the sub answers
+SubPointPattern = re.compile(r'(?:^|(?<=\s))\(\s*(\d{1,2})\s*\)')
+
+
+def split_sub_points(text):
+    """Returns [(num, text)] of the numbered points in text, the text before the first point
+    is kept with num None unless it is the minister's name ending with ':'.
+    """
+    parts = SubPointPattern.split(text or '')
+    prefix = parts[0].strip()
+
+    sub_points = []
+    if prefix and not prefix.endswith(':'):
+        sub_points.append((None, prefix))
+
+    for (num, sub_text) in zip(parts[1::2], parts[2::2]):
+        sub_points.append((int(num), sub_text.strip()))
+    return sub_points
+
+
+class SqliteExport:
+    """Keeps mahmls.sqlite in sync with the exported years, the questions of a year are
+    deleted and added again, the full text index is kept in sync by triggers.
+    """
+
+    def __init__(self, db_path):
+        self.conn = sqlite3.connect(db_path)
+        self.conn.execute('PRAGMA foreign_keys = ON')
+        self.conn.executescript(SchemaSQL)
+        self.ids = {'ministers': {}, 'names': {}}
+
+    def get_years(self):
+        return [y for (y,) in self.conn.execute('SELECT DISTINCT year FROM questions')]
+
+    def update_documents(self, infos):
+        def to_row(info):
+            row = [info.get(f, None) for f in DocumentFields]
+            row[4] = int(row[4]) if row[4] else None
+            row[6] = str(row[6]) if row[6] is not None else None
+            return row
+
+        self.conn.execute('DELETE FROM documents')
+        placeholders = ', '.join('?' * len(DocumentFields))
+        sql = f'INSERT OR REPLACE INTO documents VALUES ({placeholders})'
+        self.conn.executemany(sql, map(to_row, infos))
+
+    def delete_years(self, years):
+        for year in years:
+            self.conn.execute('DELETE FROM questions WHERE year = ?', (year,))
+
+    def get_id(self, table, lang, name):
+        key = (lang, name)
+        if key not in self.ids[table]:
+            sql = f'INSERT OR IGNORE INTO {table} (lang, name) VALUES (?, ?)'
+            self.conn.execute(sql, key)
+            sql = f'SELECT id FROM {table} WHERE lang = ? AND name = ?'
+            self.ids[table][key] = self.conn.execute(sql, key).fetchone()[0]
+        return self.ids[table][key]
+
+    def add_questions(self, lang, rows):
+        """rows are the typed question rows (see export_data.to_typed_row)."""
+        columns = ', '.join(QuestionFields)
+        placeholders = ', '.join('?' * len(QuestionFields))
+        sql = f'INSERT INTO questions ({columns}) VALUES ({placeholders})'
+
+        for row in rows:
+            minister_name = row['minister_name']
+            minister_id = self.get_id('ministers', lang, minister_name) if minister_name else None
+            question_row = {**row, 'lang': lang, 'minister_id': minister_id}
+            for date_field in ('question_date', 'answer_date'):
+                date = row[date_field]
+                question_row[date_field] = date.isoformat() if date else None
+
+            cursor = self.conn.execute(sql, [question_row[f] for f in QuestionFields])
+            question_id = cursor.lastrowid
+
+            # the names list of the qna json, a hyphen inside a name is not a separator
+            names = row['names']
+            if isinstance(names, str):
+                raise TypeError(f'names of {row["name"]} is a joined string, expected a list')
+            name_ids = [(question_id, self.get_id('names', lang, n)) for n in names]
+            self.conn.executemany('INSERT OR IGNORE INTO question_names VALUES (?, ?)', name_ids)
+
+            sub_texts = [('sub_questions', row['question']), ('sub_answers', row['answer'])]
+            for (table, text) in sub_texts:
+                sub_rows = [(question_id, n, t) for (n, t) in split_sub_points(text)]
+                self.conn.executemany(f'INSERT INTO {table} VALUES (?, ?, ?)', sub_rows)
+
+    def close(self):
+        self.conn.execute('DELETE FROM names WHERE id NOT IN (SELECT name_id FROM question_names)')
+        self.conn.execute(
+            'DELETE FROM ministers WHERE id NOT IN (SELECT minister_id FROM questions'
+            ' WHERE minister_id IS NOT NULL)'
+        )
+        self.conn.execute("INSERT INTO questions_fts (questions_fts) VALUES ('optimize')")
+        self.conn.commit()
+        self.conn.close()
@@ -1,22 +1,40 @@
 import functools
-from operator import attrgetter
+from operator import attrgetter, itemgetter
 from pathlib import Path
 
+import numpy as np
+
 from docint import pdfwrapper
 from docint.shape import Coord, Edge
 from docint.vision import Vision
 
 DEFAULT_Y_TOLERANCE = 3
 
+# a dashed line has to contain one of these runs, so only lines with these chars are checked
+DashChars = ('-', '_', '—')
+DashCodes = np.array([ord(c) for c in DashChars], dtype=np.uint32)
+
+
+def is_dashed(ln):
+    ln_text = ''.join(w.text for w in ln).strip()
+    if len(set(ln_text)) > 2:
+        return False
+    return '-----' in ln_text or '_____' in ln_text or '————' in ln_text
+
+
 @Vision.factory(
     "dashes_finder",
     default_config={
         'y_tol': DEFAULT_Y_TOLERANCE,
+        'mode': 'numpy',
     },
 )
 class PDFReader:
-    def __init__(self, y_tol):
+    def __init__(self, y_tol, mode):
         self.y_tol = y_tol
+        if mode not in ('numpy', 'words'):
+            raise ValueError(f'Unknown mode: {mode}, expected numpy or words')
+        self.mode = mode
 
     def cluster_pdfwords(self, pdfwords):
         pdfwords.sort(key=lambda bb: bb.bounding_box[1])
@@ -35,7 +53,48 @@ class PDFReader:
         lines = functools.reduce(group_words_inline, pdfwords, [])
         [ln.sort(key=attrgetter('bounding_box')) for ln in lines]
         return lines
-        
+
+    def find_dashed_lines_words(self, pdfwords):
+        # reference implementation, clusters all words in python
+        lines = self.cluster_pdfwords(pdfwords)
+        return [ln for ln in lines if is_dashed(ln)]
+
+    def find_dashed_lines_numpy(self, pdfwords):
+        if not pdfwords:
+            return []
+
+        num_words = len(pdfwords)
+        bboxes = list(map(attrgetter('bounding_box'), pdfwords))
+        tops = np.fromiter(map(itemgetter(1), bboxes), dtype=np.float64, count=num_words)
+
+        # all the texts are joined and the dash char positions are mapped back to the words
+        texts = list(map(attrgetter('text'), pdfwords))
+        text_ends = np.cumsum(list(map(len, texts)))
+        all_chars = np.frombuffer(''.join(texts).encode('utf-32-le'), dtype=np.uint32)
+
+        # stable sort on top, a new line starts when the gap from the previous word > y_tol
+        order = np.argsort(tops, kind='stable')
+        line_ids = np.concatenate(([0], np.cumsum(np.diff(tops[order]) > self.y_tol)))
+
+        is_dash_char = all_chars == DashCodes[0]
+        for dash_code in DashCodes[1:]:
+            is_dash_char |= all_chars == dash_code
+        dash_char_idxs = np.flatnonzero(is_dash_char)
+        has_dash = np.zeros(num_words, dtype=bool)
+        has_dash[np.searchsorted(text_ends, dash_char_idxs, side='right')] = True
+
+        dashed_lines = []
+        for line_id in np.unique(line_ids[has_dash[order]]):
+            start, end = np.searchsorted(line_ids, [line_id, line_id + 1])
+            line_idxs = order[start:end]
+
+            # same as sorting on the bounding_box tuple, lexsort is stable
+            line_bboxes = np.array([bboxes[idx] for idx in line_idxs], dtype=np.float64)
+            sort_keys = (line_bboxes[:, 3], line_bboxes[:, 2], line_bboxes[:, 1], line_bboxes[:, 0])
+            line = [pdfwords[idx] for idx in line_idxs[np.lexsort(sort_keys)]]
+            if is_dashed(line):
+                dashed_lines.append(line)
+        return dashed_lines
 
     def __call__(self, doc):
         def to_doc_coord(bbox, page):
@@ -44,20 +103,16 @@ class PDFReader:
             bot = Coord(x=x1/page.width, y=y1/page.height)
             return top, bot
 
-        def is_dashed(ln):
-            ln_text = ''.join(w.text for w in ln).strip()
-            if len(set(ln_text)) > 2:
-                return False
-            return '-----' in ln_text or '_____' in ln_text or '————' in ln_text
-
         doc.add_extra_page_field("dash_edges", ("list", "docint.shape", "Edge"))
-        
+
         pdf = pdfwrapper.open(doc.pdf_path)
         for page, pdf_page in zip(doc.pages, pdf.pages):
             page.dash_edges = []
 
-            lines = self.cluster_pdfwords(pdf_page.words)
-            dashed_lines = [ln for ln in lines if is_dashed(ln)]
+            if self.mode == 'numpy':
+                dashed_lines = self.find_dashed_lines_numpy(pdf_page.words)
+            else:
+                dashed_lines = self.find_dashed_lines_words(pdf_page.words)
             #print(f'Page: {page.page_idx}: Lines: {len(dashed_lines)}')
 
             for dline in dashed_lines:
@@ -0,0 +1,26 @@
+import pypdfium2 as pdfium
+import pypdfium2.raw as pdfium_c
+
+# an image covering this fraction of the page is a large image
+LargeImageFraction = 0.5
+
+
+def probe_pdf(pdf_path):
+    """Returns the number of pages and the indices of pages with a large image, only the page
+    objects are read, the text of the pages is not extracted.
+    """
+    pdf = pdfium.PdfDocument(str(pdf_path))
+    try:
+        large_image_idxs = []
+        for page_idx in range(len(pdf)):
+            page = pdf[page_idx]
+            width, height = page.get_size()
+            for obj in page.get_objects(filter=(pdfium_c.FPDF_PAGEOBJ_IMAGE,)):
+                left, bottom, right, top = obj.get_pos()
+                if (right - left) * (top - bottom) >= LargeImageFraction * width * height:
+                    large_image_idxs.append(page_idx)
+                    break
+            page.close()
+        return len(pdf), large_image_idxs
+    finally:
+        pdf.close()
@@ -7,9 +7,13 @@ from collections import Counter
 
 from docint.vision import Vision
 
+from question_lines import Saluts, classify_lines, split_sections
+
 NumDashes = 3
 Sections = ['title', 'header', 'question', 'answer']
-Saluts = ('श्री', 'श्रीमती', 'डॉ', 'प्रा.', 'अॅड', 'ॲड', 'ॲङ', 'मा.')
+
+SubPointPattern = re.compile(r'(\(\d+\))')
+SubPointParenPattern = re.compile(r'(\d+\))')
 
 @Vision.factory(
     "question_extractor2",
@@ -21,8 +25,11 @@ class QuestionExtractor:
     def __init__(self, stub):
         self.stub = stub
 
-    def parse_header(self, lines):
-        orig_text = text =' '.join(l.text_with_break() for l in lines)
+    def parse_title(self, texts):
+        return {'title': ' '.join(texts).strip('*')}
+
+    def parse_header(self, texts):
+        orig_text = text =' '.join(texts)
         
         num, text = text.strip().split(' ', 1)
         num = num.strip('()')
@@ -51,13 +58,13 @@ class QuestionExtractor:
         return {'header': orig_text, 'question_num': num, 'names': names, 'role': role,
                 'long_num': long_num, 'question_date': question_date}
 
-    def parse_question(self, lines):
-        orig_text =' '.join(l.text_with_break() for l in lines)
+    def parse_question(self, texts):
+        orig_text =' '.join(texts)
 
-        points = re.split(r'(\(\d+\))', orig_text)
+        points = SubPointPattern.split(orig_text)
         if len(points) == 1:
             # try searching for 1)...2)
-            points = re.split(r'(\d+\))', orig_text)
+            points = SubPointParenPattern.split(orig_text)
 
         sub_questions = []
         for i in range(1, len(points), 2):
@@ -65,8 +72,8 @@ class QuestionExtractor:
 
         return {'question': orig_text, 'sub_questions': sub_questions}
 
-    def parse_answer(self, lines):
-        orig_text = ' '.join(l.text_with_break() for l in lines)
+    def parse_answer(self, texts):
+        orig_text = ' '.join(texts)
         no_answer = True if 'उत्तर आले नाही' in orig_text else False
         if no_answer:
             return {'answer': orig_text, 'minister_name': '', 'sub_answers': []}
@@ -74,7 +81,7 @@ class QuestionExtractor:
         minister_name, text  = orig_text.split(':', 1)
         minister_name = minister_name.strip()
 
-        points = re.split(r'(\(\d+\))', orig_text)
+        points = SubPointPattern.split(orig_text)
         sub_answers = []
         for i in range(1, len(points), 2):
             sub_answers.append(f"{points[i]} {points[i+1].strip()}".strip())
@@ -94,83 +101,23 @@ class QuestionExtractor:
 
 
     def build_question(self, page_idx, line_idx, question_lines, question_num, doc_type):
-        def is_header_start(line):
-            line_text = line.text_with_break().strip()
-            line_text = line_text.replace('–', '-')            
-            # import pdb
-            # pdb.set_trace()
-            if doc_type == 'StarredQuestions':
-                #pattern = r"^\(\s*(\d+)\s*\)\s+([\d\s]*)\s+"
-                pattern = r"^\(\s*(\d+)\s*\)\s*([\*])*\s*([\d\s]*)\s+"
-                return bool(re.match(pattern, line_text))
-            else:
-                pattern = r"^\(\s*(\d+)\s*\)\s+(\s*\d+\s*)\s*\(\s*(\d+-\d+-\d+)\s*\)"
-                return bool(re.match(pattern, line_text))
-
-        def is_question_start(line):
-            line_text = line.text_with_break().strip().strip('◌़')
-            line_text = line_text.replace('–', '-')
-
-            if not line_text:
-                return False
-
-            m = re.match(r'^\(\s*(\d+)\s*\)|^(\d+)\)', line_text)
-            if not m:
-                return False
+        line_texts = [ln.text_with_break() for ln in question_lines]
+        line_tags = classify_lines(line_texts, doc_type)
+        has_words = [bool(ln.words) for ln in question_lines]
 
-            match_num = m.group(1) if m.group(1) else m.group(2)
-            return int(match_num) == 1
-
-        def is_answer_start(line):
-            no_answer = True if 'उत्तर आले नाही' in line.text_with_break() else False
-            if no_answer:
-                return True
-            else:
-                line_text = line.text_with_break().strip().strip('◌़')
-                if line_text:
-                    if line_text.startswith(Saluts):
-                        return True
-                    elif re.match(r'^: \(\s*(\d+)\s*\)', line_text):
-                        # no name given
-                        return True
-                    else:
-                        return False
-                else:
-                    return False
-                #return line_text and line_text.startswith(Saluts)
-
-        print_line = False
-        # if question_num == 2:
-        #     print_line = True
-        #     import pdb
-        #     pdb.set_trace()
+        sections = list(split_sections(line_texts, line_tags, has_words))
+        section_parsers = {
+            'title': self.parse_title,
+            'header': self.parse_header,
+            'question': self.parse_question,
+        }
 
         question = {}
-        section, section_lines = 'title', []
-        for idx, line in enumerate(question_lines):
-            if print_line:
-                print(f'{idx}) {section}[{len(section_lines)}]: {line.text_with_break()}')
-
-            if section == 'title' and is_header_start(line):
-                question['title'] = ' '.join(l.text_with_break() for l in section_lines).strip('*')
-                section, section_lines = 'header', []
-
-            elif section == 'header' and is_question_start(line):
-                header_info = self.parse_header(section_lines)
-                question = {**question, **header_info}
-
-                section, section_lines = 'question', []
-            elif section == 'question' and is_answer_start(line):
-                question_info = self.parse_question(section_lines)
-                question = {**question, **question_info}
-
-                section, section_lines = 'answer', []
-
-            if line.words:
-                section_lines.append(line)
+        for (section, section_texts) in sections[:-1]:
+            question.update(section_parsers[section](section_texts))
 
-        answer_info = self.parse_answer(section_lines)
-        question = {**question, **answer_info}
+        # the last section is always parsed as an answer
+        question.update(self.parse_answer(sections[-1][1]))
         return question
 
     def question_iter(self, doc):
@@ -0,0 +1,66 @@
+import re
+
+Saluts = ('श्री', 'श्रीमती', 'डॉ', 'प्रा.', 'अॅड', 'ॲड', 'ॲङ', 'मा.')
+
+# line tags, a line can carry more than one tag
+HeaderStart = 1
+QuestionStart = 2
+AnswerStart = 4
+
+StarredHeaderPattern = re.compile(r"^\(\s*(\d+)\s*\)\s*([\*])*\s*([\d\s]*)\s+")
+UnstarredHeaderPattern = re.compile(r"^\(\s*(\d+)\s*\)\s+(\s*\d+\s*)\s*\(\s*(\d+-\d+-\d+)\s*\)")
+QuestionPattern = re.compile(r'^\(\s*(\d+)\s*\)|^(\d+)\)')
+NoNameAnswerPattern = re.compile(r'^: \(\s*(\d+)\s*\)')
+
+NoAnswerStr = 'उत्तर आले नाही'
+
+# section -> (tag that ends the section, next section)
+SectionTransitions = {
+    'title': (HeaderStart, 'header'),
+    'header': (QuestionStart, 'question'),
+    'question': (AnswerStart, 'answer'),
+}
+
+
+def classify_line(line_text, header_pattern):
+    tags = 0
+
+    text = line_text.strip()
+    if header_pattern.match(text.replace('–', '-')):
+        tags |= HeaderStart
+
+    text = text.strip('◌़')
+    if not text:
+        return tags | AnswerStart if NoAnswerStr in line_text else tags
+
+    m = QuestionPattern.match(text.replace('–', '-'))
+    if m and int(m.group(1) or m.group(2)) == 1:
+        tags |= QuestionStart
+
+    if NoAnswerStr in line_text or text.startswith(Saluts) or NoNameAnswerPattern.match(text):
+        tags |= AnswerStart
+    return tags
+
+
+def classify_lines(line_texts, doc_type):
+    if doc_type == 'StarredQuestions':
+        header_pattern = StarredHeaderPattern
+    else:
+        header_pattern = UnstarredHeaderPattern
+    return [classify_line(t, header_pattern) for t in line_texts]
+
+
+def split_sections(line_texts, line_tags, has_words):
+    """Yields (section, section_texts) using the SectionTransitions table, the last section is
+    always yielded even if it is empty.
+    """
+    section, section_texts = 'title', []
+    for (text, tags, words) in zip(line_texts, line_tags, has_words):
+        end_tag, next_section = SectionTransitions.get(section, (0, None))
+        if tags & end_tag:
+            yield section, section_texts
+            section, section_texts = next_section, []
+
+        if words:
+            section_texts.append(text)
+    yield section, section_texts
@@ -1,9 +1,14 @@
 import json
 from pathlib import Path
 
+import pysbd
 from docint.util import get_full_path, get_model_path, is_readable_nonempty, is_repo_path
 from docint.vision import Vision
 
+from answer_templates import AnswerTemplateTranslator
+from trans_memory import TransMemory, read_trans_file
+from trans_table import TransTable
+
 MarathiNums = "१२३४५६७८९०.() "
 
 def is_number(cell):
@@ -25,6 +30,12 @@ def get_row_texts(row):
 
 BatchSize = 100
 
+# compiled with trans_table.py from the trans-{range} files
+TransTableFile = "conf/trans/trans.table"
+
+# documents whose unknown texts are translated together in translate_inline mode
+WindowSize = 16
+
 
 @Vision.factory(
     "question_translator",
@@ -41,11 +52,14 @@ BatchSize = 100
         "model_dir": "/import/models",
         "model_name": "ai4bharat:IndicTrans2-en/ct2_int8_model",
         "translations_dir": "conf/trans",
+        "trans_memory": "",
+        "trans_table": TransTableFile,
         "todo_dir": "conf/todos",
         "output_dir": "output",
         "write_output": False,
         "src_lang": "hindi",
         "tgt_lang": "",
+        "window_size": WindowSize,
     },
 )
 class QuestionTranslator:
@@ -56,11 +70,14 @@ class QuestionTranslator:
         model_dir,
         model_name,
         translations_dir,
+        trans_memory,
+        trans_table,
         todo_dir,
         output_dir,
         write_output,
         src_lang,
         tgt_lang,
+        window_size,
     ):
         self.conf_dir = Path("conf")
         self.stub = stub
@@ -80,54 +97,102 @@ class QuestionTranslator:
 
         self.translations_file = None
         self.todos_file = None
+        self.range_str = None
+
+        # translations are looked up in the memory instead of the trans-{range}.json files
+        self.trans_memory = TransMemory(trans_memory) if trans_memory else None
+
+        # compiled with trans_table.py, shared across the worker processes through the page cache
+        trans_table = Path(trans_table) if trans_table else None
+        self.trans_table = TransTable(trans_table) if trans_table and trans_table.exists() else None
 
         self.para_todos = set()
         self.sent_todos = set()
 
+        # formulaic sub answers are translated without the model and are never written as todos
+        self.answer_templates = AnswerTemplateTranslator(MarthiEnglishNumDict)
+        self.num_segments, self.num_template_hits = 0, 0
+
+        # memory translations of the texts of a translate_inline window, looked up in one call
+        self.window_memory = {}
+
         self.write_output = write_output
         self.src_lang = src_lang
         self.tgt_lang = tgt_lang
         self.model = None
+        self.segmenter = None
         self.num_docs = 100
+        self.window_size = window_size
 
     def load_model(self):
-        from ..models.indictrans.engine import Model
+        from docint.models.indictrans.engine import Model
 
         print(self.model_dir)
         trans_model_dir = get_model_path(self.model_name, self.model_dir)
         print(trans_model_dir)
+        self.segmenter = pysbd.Segmenter(language="mr", clean=False)
         return Model(str(trans_model_dir), device="cpu")
 
+    def split_sentences(self, para):
+        return [s.strip() for s in self.segmenter.segment(para) if s.strip()]
+
     def get_range_str(self, doc_num):
         # 423 -> '401-500'
         base_num = doc_num - (doc_num % self.num_docs)
         return f'{base_num+1}-{base_num+100}'
 
-    def load_translations(self, doc):
+    def get_doc_range_str(self, doc):
         doc_num, _ = doc.pdf_name.split('-')[1].split('.')
-        range_str = self.get_range_str(int(doc_num))
+        return self.get_range_str(int(doc_num))
+
+    def load_translations(self, doc):
+        range_str = self.get_doc_range_str(doc)
+        self.range_str = range_str
 
         # file does not exist or there is a mismatch
         if not self.translations_file or self.translations_file.name != f'trans-{range_str}.json':
             self.translations_file = self.translations_dir / f'trans-{range_str}.json'
 
         self.translations = {}
-        if is_readable_nonempty(self.translations_file):
-            json_list = json.loads(self.translations_file.read_text())
-            for trans_dict in json_list:
-                m, e = trans_dict["mr"], trans_dict["en"]
-                self.translations[m] = e
+        if self.trans_memory:
+            return
+
+        # collab_translate saves the translations as trans-{range}.json.gz
+        gz_file = self.translations_file.parent / f'{self.translations_file.name}.gz'
+
+        # the files are parsed only if they were written after the table was compiled
+        if self.trans_table:
+            table_mtime = self.trans_table.table_file.stat().st_mtime
+            trans_files = [f for f in (self.translations_file, gz_file) if f.exists()]
+            if all(f.stat().st_mtime <= table_mtime for f in trans_files):
+                return
+
+        # collab_translate resumes from the plain json and writes a superset to the .gz, the
+        # entries of the newer file override those of the older one
+        trans_files = [f for f in (self.translations_file, gz_file) if is_readable_nonempty(f)]
+        for trans_file in sorted(trans_files, key=lambda f: f.stat().st_mtime):
+            for trans_dict in read_trans_file(trans_file):
+                self.translations[trans_dict["mr"]] = trans_dict["en"]
 
     def save_translations(self):
+        if self.trans_memory:
+            self.trans_memory.add(self.translations.items(), self.range_str)
+            return
+
+        # merged into the saved file, in table mode self.translations has only the new texts
+        translations = dict((d["mr"], d["en"]) for d in read_trans_file(self.translations_file))
+        translations.update(self.translations)
+
         save_trans = sorted(
-            [{"mr": k, "en": v} for (k, v) in self.translations.items()],
+            [{"mr": k, "en": v} for (k, v) in translations.items()],
             key=lambda d: d["mr"],
         )
-        self.translations_file.write_text(json.dumps(save_trans, indent=2, ensure_ascii=False))
+        tmp_file = self.translations_file.parent / f'{self.translations_file.name}.tmp'
+        tmp_file.write_text(json.dumps(save_trans, indent=2, ensure_ascii=False))
+        tmp_file.replace(self.translations_file)
 
     def load_todos(self, doc):
-        doc_num, _ = doc.pdf_name.split('-')[1].split('.')
-        range_str = self.get_range_str(int(doc_num))
+        range_str = self.get_doc_range_str(doc)
 
         # file does not exist or there is a mismatch
         if not self.todos_file or self.todos_file.name != f'todos-{range_str}.json':
@@ -143,30 +208,53 @@ class QuestionTranslator:
             todo = {"paras": sorted(self.para_todos), "sents": sorted(self.sent_todos)}
             self.todos_file.write_text(json.dumps(todo, indent=2, ensure_ascii=False))
 
-    def para_translate(self, para_texts):
-        para_trans = [
-            self.model.translate_paragraph(p, self.src_lang, self.tgt_lang) for p in para_texts
-        ]
-        for (p, t) in zip(para_texts, para_trans):
-            self.indic2en_trans[p] = t
-        self.save_translations()
+    def model_translate(self, paras, sents):
+        # the model is loaded once per process, on the first window with unknown texts
+        if self.model is None:
+            self.model = self.load_model()
+
+        # paras are split into sentences, all sentences of the window go in one batch call
+        para_sents = [self.split_sentences(p) for p in paras]
+        all_sents = list(dict.fromkeys(sents + [s for ps in para_sents for s in ps]))
+        all_trans = self.model.batch_translate(all_sents, self.src_lang, self.tgt_lang)
+        sent_trans = dict(zip(all_sents, all_trans))
 
-    def sentences_translate(self, sents):
-        sents_trans = self.model.batch_translate(sents, self.src_lang, self.tgt_lang)
-        for (s, t) in zip(sents, sents_trans):
-            self.indic2en_trans[s] = t
+        self.translations.update((s, sent_trans[s]) for s in sents)
+        for (para, p_sents) in zip(paras, para_sents):
+            self.translations[para] = ' '.join(sent_trans[s] for s in p_sents)
         self.save_translations()
+        print(f"Translated #paras: {len(paras)} #sents: {len(all_sents)}")
 
     def get_trans(self, text):
         if text.isascii():
             return text
         else:
+            self.num_segments += 1
             t = self.translations.get(text, None)
+            if t is None and self.trans_table:
+                t = self.trans_table.get(text)
+            if t is None and self.trans_memory:
+                t = self.window_memory.get(text, None)
+                t = t if t is not None else self.trans_memory.get(text, self.range_str)
             if t is None:
                 print(f'**TRANSLATE_ERROR: {text}')
             return t
         #return None if text.isascii() else self.translations.get(text, None)
 
+    def get_answer_trans(self, text):
+        t = None if text.isascii() else self.answer_templates.translate(text)
+        if t is None:
+            return self.get_trans(text)
+
+        self.num_segments += 1
+        self.num_template_hits += 1
+        return t
+
+    def template_share_str(self):
+        num_hits = self.num_template_hits
+        hit_pct = 100 * num_hits / self.num_segments if self.num_segments else 0.0
+        return f'{num_hits}/{self.num_segments} ({hit_pct:.1f}%)'
+
     def translate_question(self, question):
         def mk_list(lst):
             return lst if isinstance(lst, list) else [lst]            
@@ -187,7 +275,9 @@ class QuestionTranslator:
         en_question['minister_name'] = self.get_trans(question['minister_name'])
 
         en_question['sub_questions'] = [self.get_trans(s) for s in question.get('sub_questions',[])]
-        en_question['sub_answers'] = [self.get_trans(s) for s in question.get('sub_answers', [])]
+        en_question['sub_answers'] = [
+            self.get_answer_trans(s) for s in question.get('sub_answers', [])
+        ]
 
         en_question['question'] = '\n'.join(q for q in en_question['sub_questions'] if q)
         en_question['answer'] = '\n'.join(a for a in en_question['sub_answers'] if a)
@@ -203,6 +293,81 @@ class QuestionTranslator:
 
         return en_question, todo_paras, todo_sents
 
+    def get_question_texts(self, question):
+        """Returns the paras and the sentences of the question that need a translation, the
+        template answers are left out.
+        """
+        def mk_list(lst):
+            return lst if isinstance(lst, list) else [lst]
+
+        answers = mk_list(question.get('sub_answers', []))
+        paras = [question['title']] + mk_list(question.get('sub_questions', []))
+        paras += [a for a in answers if self.answer_templates.translate(a) is None]
+        sents = mk_list(question['names']) + [question['role'], question['minister_name']]
+        return [p for p in paras if not p.isascii()], [s for s in sents if not s.isascii()]
+
+    def is_known(self, text):
+        if text in self.translations or text in self.window_memory:
+            return True
+        return bool(self.trans_table and self.trans_table.get(text) is not None)
+
+    def translate_window(self, docs):
+        """Translates the unknown texts of all the docs in one model call and fills
+        en_questions, the docs belong to the same range.
+        """
+        docs = [doc for doc in docs if doc.questions]
+        if not docs:
+            return
+        self.load_translations(docs[0])
+
+        paras, sents = {}, {}
+        for doc in docs:
+            for question in doc.questions:
+                q_paras, q_sents = self.get_question_texts(question)
+                paras.update(dict.fromkeys(q_paras))
+                sents.update(dict.fromkeys(q_sents))
+            sents.update(dict.fromkeys(s for s in doc.header_lines if not s.isascii()))
+
+        if self.trans_memory:
+            texts = [t for t in list(paras) + list(sents) if not self.is_known(t)]
+            self.window_memory = self.trans_memory.get_many(texts, self.range_str)
+
+        todo_paras = [p for p in paras if not self.is_known(p)]
+        todo_sents = [s for s in sents if not self.is_known(s)]
+        if todo_paras or todo_sents:
+            self.model_translate(todo_paras, todo_sents)
+
+        for doc in docs:
+            doc.en_questions = [self.translate_question(q)[0] for q in doc.questions]
+        self.window_memory = {}
+
+        if self.trans_memory:
+            self.trans_memory.save_hits()
+
+    def pipe(self, docs):
+        """In translate_inline mode the docs are translated in windows of window_size docs."""
+        if self.mode != 'translate_inline':
+            yield from (self(doc) for doc in docs)
+            return
+
+        window = []
+        for doc in docs:
+            doc.add_extra_page_field("en_questions", ("noparse", "", ""))
+            if not doc.questions:
+                doc.en_questions = []
+
+            # translations are saved per range, a window does not cross ranges
+            new_range = window and self.get_doc_range_str(window[0]) != self.get_doc_range_str(doc)
+            if window and (new_range or len(window) >= self.window_size):
+                self.translate_window(window)
+                yield from window
+                window = []
+            window.append(doc)
+
+        if window:
+            self.translate_window(window)
+            yield from window
+
     def __call__(self, doc):
         doc.add_extra_page_field("en_questions", ("noparse", "", ""))
         if not doc.questions:
@@ -241,7 +406,13 @@ class QuestionTranslator:
                 self.save_todos()
             else:
                 print(f"No todos to write write_todos: {write_todos}")
-        else:
-            pass
+
+            print(f"Segments translated by templates: {self.template_share_str()}")
+            if self.trans_memory:
+                # texts found through another range are recorded for this range too
+                self.trans_memory.save_hits()
+                print(f"Translation memory hits: {self.trans_memory.hit_rate_str()}")
+        elif self.mode == 'translate_inline':
+            self.translate_window([doc])
 
         return doc
@@ -0,0 +1,101 @@
+import hashlib
+import json
+import sqlite3
+from pathlib import Path
+
+MaxEntries = 200000
+
+# sqlite limits the number of parameters of a statement
+LookupBatchSize = 500
+
+
+def text_hash(text):
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+
+class TextCache:
+    """Persistent LRU cache from the hash of a text to a json value, kept in a sqlite table.
+    Each lookup stamps the entry with a use counter, on save the entries beyond max_entries
+    with the oldest stamp are evicted.
+    """
+
+    def __init__(self, db_path, name, max_entries=MaxEntries):
+        self.db_path = Path(db_path)
+        self.table = f'cache_{name}'
+        self.max_entries = max_entries
+
+        self.conn = sqlite3.connect(self.db_path)
+        self.conn.execute('PRAGMA journal_mode = WAL')
+        self.conn.execute(
+            f'CREATE TABLE IF NOT EXISTS {self.table}'
+            ' (key TEXT PRIMARY KEY, value TEXT NOT NULL, used INTEGER NOT NULL)'
+        )
+        self.conn.execute(f'CREATE INDEX IF NOT EXISTS {self.table}_used ON {self.table} (used)')
+
+        sql = f'SELECT MAX(used) FROM {self.table}'
+        self.use_count = self.conn.execute(sql).fetchone()[0] or 0
+
+        self.new_entries, self.used_keys = {}, {}
+        self.hits, self.misses = 0, 0
+
+    def get_many(self, texts):
+        """Returns {text: value} of the cached texts."""
+        key_texts = {}
+        for text in texts:
+            key_texts.setdefault(text_hash(text), []).append(text)
+
+        values = {}
+        for key in [k for k in key_texts if k in self.new_entries]:
+            values.update((t, self.new_entries[key]) for t in key_texts[key])
+
+        keys = [k for k in key_texts if k not in self.new_entries]
+        for start_idx in range(0, len(keys), LookupBatchSize):
+            batch_keys = keys[start_idx : start_idx + LookupBatchSize]
+            placeholders = ', '.join('?' * len(batch_keys))
+            sql = f'SELECT key, value FROM {self.table} WHERE key IN ({placeholders})'
+            for (key, value_str) in self.conn.execute(sql, batch_keys):
+                value = json.loads(value_str)
+                values.update((t, value) for t in key_texts[key])
+
+        self.use_count += 1
+        for text in values:
+            self.used_keys[text_hash(text)] = self.use_count
+
+        num_texts = sum(len(ts) for ts in key_texts.values())
+        self.hits += len(values)
+        self.misses += num_texts - len(values)
+        return values
+
+    def put_many(self, text_values):
+        self.use_count += 1
+        for (text, value) in text_values:
+            key = text_hash(text)
+            self.new_entries[key] = value
+            self.used_keys[key] = self.use_count
+
+    def save(self):
+        with self.conn:
+            sql = f'INSERT OR REPLACE INTO {self.table} (key, value, used) VALUES (?, ?, ?)'
+            rows = [
+                (k, json.dumps(v, ensure_ascii=False), self.used_keys[k])
+                for (k, v) in self.new_entries.items()
+            ]
+            self.conn.executemany(sql, rows)
+
+            sql = f'UPDATE {self.table} SET used = ? WHERE key = ?'
+            self.conn.executemany(sql, [(u, k) for (k, u) in self.used_keys.items()])
+
+            sql = f'''DELETE FROM {self.table} WHERE key IN (
+                SELECT key FROM {self.table} ORDER BY used DESC LIMIT -1 OFFSET ?)'''
+            self.conn.execute(sql, (self.max_entries,))
+
+        self.new_entries, self.used_keys = {}, {}
+
+    def stats_str(self):
+        num_lookups = self.hits + self.misses
+        hit_pct = 100 * self.hits / num_lookups if num_lookups else 0.0
+        return f'{self.table} hits: {self.hits} misses: {self.misses} ({hit_pct:.1f}% hits)'
+
+    def close(self):
+        self.save()
+        self.conn.close()
@@ -0,0 +1,341 @@
+"""
+Translation memory kept in a sqlite file, translations are keyed by a hash of the normalized
+source text. Lookups are indexed and a batch of new translations is appended in a single
+transaction, so saving costs as much as the batch and not the whole memory.
+
+The trans-{range}.json files can be imported into and exported from the memory
+
+    python trans_memory.py import trans_memory.sqlite conf/trans/trans-*.json
+    python trans_memory.py export trans_memory.sqlite conf/trans
+
+The memory is shared by all the ranges, a string that recurs across ranges is translated
+once. Every exact source text is kept under its key, a text found through another text of
+the same key is added as well and recorded in its range, so an exported trans-{range}.json
+resolves the exact strings of the range. The corpus wide dedup and hit rates of the todo
+files are reported with
+
+    python trans_memory.py stats trans_memory.sqlite conf/todos/todos-*.json
+"""
+import argparse
+import gzip
+import hashlib
+import json
+import re
+import sqlite3
+import unicodedata
+from pathlib import Path
+
+TranslationsSQL = '''
+CREATE TABLE IF NOT EXISTS translations (
+    key TEXT NOT NULL,
+    src TEXT NOT NULL,
+    tgt TEXT NOT NULL,
+    PRIMARY KEY (key, src)
+)'''
+
+SchemaSQL = f'''
+{TranslationsSQL};
+
+CREATE TABLE IF NOT EXISTS meta (
+    name TEXT PRIMARY KEY,
+    value TEXT
+);
+
+CREATE TABLE IF NOT EXISTS ranges (
+    range TEXT NOT NULL,
+    key TEXT NOT NULL,
+    PRIMARY KEY (range, key)
+) WITHOUT ROWID;
+'''
+
+# sqlite limits the number of parameters of a statement
+LookupBatchSize = 500
+
+SpacePattern = re.compile(r'\s+')
+
+# devanagari digits are mapped to ascii as in question_translator.MarthiEnglishNumDict
+DigitTable = str.maketrans('०१२३४५६७८९', '0123456789')
+
+# the keys are computed again when the normalization changes
+NormalizeVersion = '2'
+
+# version 1 kept a single source text per key
+SchemaVersion = '2'
+
+
+def normalize_text(text):
+    text = unicodedata.normalize('NFC', text).translate(DigitTable)
+    return SpacePattern.sub(' ', text).strip()
+
+
+def text_key(text):
+    return hashlib.sha1(normalize_text(text).encode('utf-8')).hexdigest()
+
+
+def unique_texts(texts):
+    # first text of each normalized form, the rest are resolved from its translation
+    seen_keys, uniq_texts = set(), []
+    for text in texts:
+        key = text_key(text)
+        if key not in seen_keys:
+            seen_keys.add(key)
+            uniq_texts.append(text)
+    return uniq_texts
+
+
+def get_file_range(trans_file):
+    # trans-401-500.json.gz -> '401-500'
+    return Path(trans_file).name.split('.')[0].split('-', 1)[1]
+
+
+def read_content_version(db_path):
+    """Returns the content version of the memory at db_path, '' if there is no memory. The
+    version changes only when a translation is added or changed.
+    """
+    db_path = Path(db_path)
+    if not db_path.exists():
+        return ''
+
+    conn = sqlite3.connect(f'{db_path.resolve().as_uri()}?mode=ro', uri=True)
+    try:
+        row = conn.execute("SELECT value FROM meta WHERE name = 'content_version'").fetchone()
+    except sqlite3.OperationalError:
+        row = None
+    finally:
+        conn.close()
+    return row[0] if row else ''
+
+
+def read_trans_file(trans_file):
+    trans_file = Path(trans_file)
+    if not trans_file.exists() or trans_file.stat().st_size == 0:
+        return []
+
+    if trans_file.name.endswith('gz'):
+        with gzip.open(trans_file, "rb") as f:
+            return json.loads(f.read())
+    return json.loads(trans_file.read_text())
+
+
+class TransMemory:
+    def __init__(self, db_path, src_lang='mr', tgt_lang='en'):
+        self.db_path = Path(db_path)
+        self.src_lang, self.tgt_lang = src_lang, tgt_lang
+
+        self.conn = sqlite3.connect(self.db_path)
+        self.conn.execute('PRAGMA journal_mode = WAL')
+        self.conn.execute('PRAGMA synchronous = NORMAL')
+        self.conn.executescript(SchemaSQL)
+
+        self.num_lookups, self.num_hits = 0, 0
+        if self.get_meta('schema_version') != SchemaVersion:
+            self.migrate()
+        if self.get_meta('normalize_version') != NormalizeVersion:
+            self.rekey()
+
+        # {range: {text: tgt}} of the texts found with get(text, range_str), see save_hits
+        self.range_hits = {}
+
+    def get_meta(self, name):
+        row = self.conn.execute('SELECT value FROM meta WHERE name = ?', (name,)).fetchone()
+        return row[0] if row else None
+
+    def set_meta(self, name, value):
+        sql = 'INSERT OR REPLACE INTO meta (name, value) VALUES (?, ?)'
+        self.conn.execute(sql, (name, value))
+
+    def migrate(self):
+        # the translations table is rebuilt with (key, src) as the primary key
+        self.conn.execute('BEGIN IMMEDIATE')
+        try:
+            self.conn.execute('ALTER TABLE translations RENAME TO translations_old')
+            self.conn.execute(TranslationsSQL)
+            self.conn.execute('INSERT INTO translations SELECT key, src, tgt FROM translations_old')
+            self.conn.execute('DROP TABLE translations_old')
+            self.set_meta('schema_version', SchemaVersion)
+            self.conn.commit()
+        except BaseException:
+            self.conn.rollback()
+            raise
+
+    def rekey(self):
+        """Computes the keys with the current normalize_text, every source text is kept, texts
+        that now normalize to the same key share it.
+        """
+        with self.conn:
+            rows = self.conn.execute('SELECT key, src, tgt FROM translations').fetchall()
+            range_rows = self.conn.execute('SELECT range, key FROM ranges').fetchall()
+
+            # the sources of an old key can get different new keys
+            new_keys = {}
+            for (key, src, _) in rows:
+                new_keys.setdefault(key, set()).add(text_key(src))
+
+            self.conn.execute('DELETE FROM translations')
+            self.conn.execute('DELETE FROM ranges')
+            sql = 'INSERT OR IGNORE INTO translations (key, src, tgt) VALUES (?, ?, ?)'
+            self.conn.executemany(sql, [(text_key(s), s, t) for (_, s, t) in rows])
+
+            sql = 'INSERT OR IGNORE INTO ranges (range, key) VALUES (?, ?)'
+            range_keys = [(r, n) for (r, k) in range_rows for n in new_keys.get(k, ())]
+            self.conn.executemany(sql, range_keys)
+
+            self.set_meta('normalize_version', NormalizeVersion)
+
+    def hit_rate_str(self):
+        hit_pct = 100 * self.num_hits / self.num_lookups if self.num_lookups else 0.0
+        return f'{self.num_hits}/{self.num_lookups} ({hit_pct:.1f}%)'
+
+    def __len__(self):
+        return self.conn.execute('SELECT COUNT(*) FROM translations').fetchone()[0]
+
+    def __contains__(self, text):
+        return self.get(text) is not None
+
+    def get(self, text, range_str=None):
+        """Returns the translation of text, the translation of the exact text if it is in the
+        memory. With range_str the hit is recorded for the range, saved with save_hits().
+        """
+        # the exact source sorts first
+        sql = 'SELECT tgt FROM translations WHERE key = ? ORDER BY src = ? DESC LIMIT 1'
+        row = self.conn.execute(sql, (text_key(text), text)).fetchone()
+        self.num_lookups += 1
+        self.num_hits += 1 if row else 0
+
+        if row and range_str:
+            self.range_hits.setdefault(range_str, {})[text] = row[0]
+        return row[0] if row else None
+
+    def save_hits(self):
+        for (range_str, hits) in self.range_hits.items():
+            self.add(hits.items(), range_str, replace=False)
+        self.range_hits = {}
+
+    def get_many(self, texts, range_str=None):
+        """Returns {text: translation} for the texts present in the memory, with range_str the
+        texts found are added to the memory as part of that range.
+        """
+        texts = list(texts)
+        key_texts = {}
+        for text in texts:
+            key_texts.setdefault(text_key(text), []).append(text)
+
+        keys, translations = list(key_texts), {}
+        for start_idx in range(0, len(keys), LookupBatchSize):
+            batch_keys = keys[start_idx : start_idx + LookupBatchSize]
+            placeholders = ', '.join('?' * len(batch_keys))
+            sql = f'SELECT key, src, tgt FROM translations WHERE key IN ({placeholders})'
+            for (key, src, tgt) in self.conn.execute(sql, batch_keys):
+                for text in key_texts[key]:
+                    if text not in translations or text == src:
+                        translations[text] = tgt
+
+        self.num_lookups += len(texts)
+        self.num_hits += len(translations)
+
+        if range_str and translations:
+            self.add(translations.items(), range_str, replace=False)
+        return translations
+
+    def add(self, src_tgts, range_str=None, replace=True):
+        """Appends the (src, tgt) pairs in one transaction, a src with the key of another src
+        is kept as well. range_str records the pairs as part of that range for the export of
+        trans-{range}.json. Without replace only the missing pairs are written, a lookup does
+        not modify the file.
+        """
+        rows = [(text_key(s), s, t) for (s, t) in src_tgts]
+        with self.conn:
+            verb = 'REPLACE' if replace else 'IGNORE'
+            sql = f'INSERT OR {verb} INTO translations (key, src, tgt) VALUES (?, ?, ?)'
+            if self.conn.executemany(sql, rows).rowcount > 0:
+                # read by the build manifest, the sqlite file changes without new translations
+                content_version = int(self.get_meta('content_version') or 0) + 1
+                self.set_meta('content_version', str(content_version))
+            if range_str:
+                sql = 'INSERT OR IGNORE INTO ranges (range, key) VALUES (?, ?)'
+                self.conn.executemany(sql, [(range_str, k) for (k, _, _) in rows])
+        return len(rows)
+
+    def import_file(self, trans_file, range_str=None):
+        range_str = range_str if range_str else get_file_range(trans_file)
+        trans_list = read_trans_file(trans_file)
+        src_tgts = [(d[self.src_lang], d[self.tgt_lang]) for d in trans_list]
+        return self.add(src_tgts, range_str)
+
+    def get_range_translations(self, range_str=None):
+        if range_str:
+            sql = 'SELECT t.src, t.tgt FROM ranges r JOIN translations t ON t.key = r.key'
+            rows = self.conn.execute(sql + ' WHERE r.range = ?', (range_str,))
+        else:
+            rows = self.conn.execute('SELECT src, tgt FROM translations')
+        return sorted(rows)
+
+    def get_ranges(self):
+        return [r for (r,) in self.conn.execute('SELECT DISTINCT range FROM ranges')]
+
+    def export_file(self, trans_file, range_str=None):
+        """Writes the translations in the trans-{range}.json format, sorted on the source. All
+        the sources of a key in the range are written, each with its own translation.
+        """
+        trans_file = Path(trans_file)
+        range_trans = self.get_range_translations(range_str)
+        save_trans = [{self.src_lang: s, self.tgt_lang: t} for (s, t) in range_trans]
+        if trans_file.name.endswith('gz'):
+            with gzip.open(trans_file, "wb") as f:
+                f.write(bytes(json.dumps(save_trans, ensure_ascii=False), encoding='utf-8'))
+        else:
+            trans_file.write_text(json.dumps(save_trans, indent=2, ensure_ascii=False))
+        return len(save_trans)
+
+    def close(self):
+        self.conn.close()
+
+
+def print_stats(trans_memory, todo_files):
+    """Prints the corpus wide dedup of the todo files and how many reach the model."""
+    num_entries = len(trans_memory)
+    sql = 'SELECT COUNT(*) FROM ranges'
+    num_range_entries = trans_memory.conn.execute(sql).fetchone()[0]
+    print(f'#translations: {num_entries} #range translations: {num_range_entries}')
+
+    all_texts = []
+    for todo_file in todo_files:
+        todos = json.loads(Path(todo_file).read_text())
+        all_texts += todos.get('paras', []) + todos.get('sents', []) + todos.get('cells', [])
+
+    uniq_texts = unique_texts(all_texts)
+    found = trans_memory.get_many(uniq_texts)
+    num_todos = len(uniq_texts) - len(found)
+
+    print(f'#todo segments: {len(all_texts)} #unique normalized: {len(uniq_texts)}')
+    print(f'memory hits: {trans_memory.hit_rate_str()} #to translate: {num_todos}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Import, export trans-{range}.json files.')
+    parser.add_argument('command', choices=['import', 'export', 'stats'])
+    parser.add_argument('db_path', type=Path)
+    parser.add_argument('paths', nargs='+', type=Path, help='trans/todo files or export dir')
+    args = parser.parse_args()
+
+    trans_memory = TransMemory(args.db_path)
+    if args.command == 'import':
+        for trans_file in args.paths:
+            num_trans = trans_memory.import_file(trans_file)
+            print(f'Imported {num_trans} from {trans_file.name}')
+    elif args.command == 'stats':
+        print_stats(trans_memory, args.paths)
+    else:
+        export_dir = args.paths[0]
+        for range_str in sorted(trans_memory.get_ranges()):
+            trans_file = export_dir / f'trans-{range_str}.json'
+            num_trans = trans_memory.export_file(trans_file, range_str)
+            print(f'Exported {num_trans} to {trans_file.name}')
+
+    if args.command != 'stats':
+        print(f'#translations: {len(trans_memory)}')
+    trans_memory.close()
+
+
+if __name__ == "__main__":
+    main()
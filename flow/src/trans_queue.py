@@ -0,0 +1,227 @@
+"""
+Work queue of the texts to translate, kept in a sqlite file so that several translator
+workers, on one or more hosts sharing the filesystem, can drain the todos together.
+
+A worker leases a batch of pending texts, translates them and acks the translations. A lease
+expires after lease_secs, the texts of a worker that crashed are then leased again, a text
+that failed MaxAttempts leases is marked failed. Only the queue is written by the workers,
+the translations are merged into the trans-{range}.json.gz files by a single export
+
+    python trans_queue.py add trans_queue.sqlite conf/todos/todos-*.json
+    TRANS_QUEUE=trans_queue.sqlite python collab_translate.py input output   # on each host
+    python trans_queue.py export trans_queue.sqlite output
+    python trans_queue.py stats trans_queue.sqlite
+
+The rollback journal is used instead of WAL as WAL needs shared memory, which is not
+available across hosts.
+"""
+import argparse
+import gzip
+import json
+import sqlite3
+import time
+from pathlib import Path
+
+from trans_memory import get_file_range, read_trans_file, text_key
+
+SegmentRangesSQL = '''
+CREATE TABLE IF NOT EXISTS segment_ranges (
+    range TEXT NOT NULL,
+    key TEXT NOT NULL,
+    text TEXT NOT NULL,
+    PRIMARY KEY (range, text)
+) WITHOUT ROWID'''
+
+SchemaSQL = f'''
+CREATE TABLE IF NOT EXISTS segments (
+    key TEXT PRIMARY KEY,
+    text TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    range TEXT NOT NULL,
+    state TEXT NOT NULL DEFAULT 'pending',
+    owner TEXT,
+    lease_expires REAL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    tgt TEXT
+);
+
+CREATE INDEX IF NOT EXISTS segments_state ON segments (state, lease_expires);
+
+{SegmentRangesSQL};
+'''
+
+LeaseSecs = 3600
+LeaseSize = 2000
+MaxAttempts = 3
+
+# waiting for the lock of another worker, in milliseconds
+BusyTimeout = 60000
+
+
+class TransQueue:
+    def __init__(self, db_path, lease_secs=LeaseSecs):
+        self.db_path = Path(db_path)
+        self.lease_secs = lease_secs
+
+        # autocommit, the transactions are started explicitly
+        self.conn = sqlite3.connect(self.db_path, isolation_level=None, timeout=BusyTimeout / 1000)
+        self.conn.execute(f'PRAGMA busy_timeout = {BusyTimeout}')
+        self.conn.executescript(SchemaSQL)
+        self.migrate()
+
+    def migrate(self):
+        # queues created before the exact texts were kept per range, the text of the segment
+        # is the best guess for them
+        columns = [r[1] for r in self.conn.execute('PRAGMA table_info(segment_ranges)')]
+        if 'text' in columns:
+            return
+
+        self.conn.execute('BEGIN IMMEDIATE')
+        try:
+            self.conn.execute('ALTER TABLE segment_ranges RENAME TO segment_ranges_old')
+            self.conn.execute(SegmentRangesSQL)
+            sql = '''INSERT INTO segment_ranges SELECT r.range, r.key, s.text
+                FROM segment_ranges_old r JOIN segments s ON s.key = r.key'''
+            self.conn.execute(sql)
+            self.conn.execute('DROP TABLE segment_ranges_old')
+            self.conn.execute('COMMIT')
+        except BaseException:
+            self.conn.execute('ROLLBACK')
+            raise
+
+    def add_todos(self, todos, range_str):
+        """Adds the paras and sents of a todos dict, texts already in the queue are skipped."""
+        rows = [(text_key(t), t, 'para', range_str) for t in todos.get('paras', [])]
+        rows += [(text_key(t), t, 'sent', range_str) for t in todos.get('sents', [])]
+
+        self.conn.execute('BEGIN IMMEDIATE')
+        try:
+            sql = 'INSERT OR IGNORE INTO segments (key, text, kind, range) VALUES (?, ?, ?, ?)'
+            self.conn.executemany(sql, rows)
+
+            # a text shared by ranges is translated once and exported to all of them, each range
+            # keeps its exact text as the lookups of question_translator are exact
+            sql = 'INSERT OR IGNORE INTO segment_ranges (range, key, text) VALUES (?, ?, ?)'
+            self.conn.executemany(sql, [(range_str, k, t) for (k, t, _, _) in rows])
+            self.conn.execute('COMMIT')
+        except BaseException:
+            self.conn.execute('ROLLBACK')
+            raise
+        return len(rows)
+
+    def add_todo_file(self, todo_file):
+        todo_file = Path(todo_file)
+        if todo_file.name.endswith('gz'):
+            with gzip.open(todo_file, "rb") as f:
+                todos = json.loads(f.read())
+        else:
+            todos = json.loads(todo_file.read_text())
+        return self.add_todos(todos, get_file_range(todo_file))
+
+    def lease(self, worker_id, max_items=LeaseSize):
+        """Returns [(text, kind)] leased to the worker, pending texts and texts whose lease
+        expired are leased, paras before sents.
+        """
+        now = time.time()
+        self.conn.execute('BEGIN IMMEDIATE')
+        try:
+            sql = f'''UPDATE segments SET state = 'failed', owner = NULL
+                WHERE state = 'leased' AND lease_expires < ? AND attempts >= {MaxAttempts}'''
+            self.conn.execute(sql, (now,))
+
+            sql = '''SELECT key, text, kind FROM segments
+                WHERE state = 'pending' OR (state = 'leased' AND lease_expires < ?)
+                ORDER BY kind, key LIMIT ?'''
+            rows = self.conn.execute(sql, (now, max_items)).fetchall()
+
+            sql = '''UPDATE segments SET state = 'leased', owner = ?, lease_expires = ?,
+                attempts = attempts + 1 WHERE key = ?'''
+            expires = now + self.lease_secs
+            self.conn.executemany(sql, [(worker_id, expires, k) for (k, _, _) in rows])
+            self.conn.execute('COMMIT')
+        except BaseException:
+            self.conn.execute('ROLLBACK')
+            raise
+        return [(text, kind) for (_, text, kind) in rows]
+
+    def ack(self, src_tgts):
+        """Records the translations, an ack after the lease expired is still accepted as the
+        translation of a text does not depend on the worker.
+        """
+        rows = [(t, text_key(s)) for (s, t) in src_tgts]
+        self.conn.execute('BEGIN IMMEDIATE')
+        try:
+            sql = '''UPDATE segments SET state = 'done', tgt = ?, owner = NULL
+                WHERE key = ? AND state IN ('pending', 'leased', 'failed')'''
+            self.conn.executemany(sql, rows)
+            self.conn.execute('COMMIT')
+        except BaseException:
+            self.conn.execute('ROLLBACK')
+            raise
+        return len(rows)
+
+    def release(self, worker_id):
+        # texts leased by the worker are returned to the queue, on a clean shutdown
+        sql = '''UPDATE segments SET state = 'pending', owner = NULL, attempts = attempts - 1
+            WHERE state = 'leased' AND owner = ?'''
+        self.conn.execute(sql, (worker_id,))
+
+    def get_state_counts(self):
+        sql = 'SELECT state, COUNT(*) FROM segments GROUP BY state'
+        return dict(self.conn.execute(sql).fetchall())
+
+    def get_range_translations(self):
+        sql = '''SELECT r.range, r.text, s.tgt FROM segment_ranges r
+            JOIN segments s ON s.key = r.key WHERE s.state = 'done' '''
+        range_trans = {}
+        for (range_str, src, tgt) in self.conn.execute(sql):
+            range_trans.setdefault(range_str, {})[src] = tgt
+        return range_trans
+
+    def export(self, output_dir, src_lang='mr', tgt_lang='en'):
+        """Merges the done translations into output_dir/trans-{range}.json.gz, returns the
+        number of translations exported per range.
+        """
+        output_dir, num_exported = Path(output_dir), {}
+        for (range_str, translations) in self.get_range_translations().items():
+            trans_file = output_dir / f'trans-{range_str}.json.gz'
+            plain_file = output_dir / f'trans-{range_str}.json'
+            saved_file = trans_file if trans_file.exists() else plain_file
+            trans = dict((d[src_lang], d[tgt_lang]) for d in read_trans_file(saved_file))
+            trans.update(translations)
+
+            save_trans = [{src_lang: s, tgt_lang: t} for (s, t) in trans.items()]
+            tmp_file = output_dir / f'{trans_file.name}.tmp'
+            with gzip.open(tmp_file, "wb") as f:
+                f.write(bytes(json.dumps(save_trans, ensure_ascii=False), encoding='utf-8'))
+            tmp_file.replace(trans_file)
+            num_exported[range_str] = len(translations)
+        return num_exported
+
+    def close(self):
+        self.conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Queue todos and export the translations.')
+    parser.add_argument('command', choices=['add', 'export', 'stats'])
+    parser.add_argument('db_path', type=Path)
+    parser.add_argument('paths', nargs='*', type=Path, help='todo files or the export dir')
+    args = parser.parse_args()
+
+    trans_queue = TransQueue(args.db_path)
+    if args.command == 'add':
+        for todo_file in args.paths:
+            num_added = trans_queue.add_todo_file(todo_file)
+            print(f'Queued {num_added} from {todo_file.name}')
+    elif args.command == 'export':
+        export_dir = args.paths[0] if args.paths else Path('.')
+        for (range_str, num_trans) in sorted(trans_queue.export(export_dir).items()):
+            print(f'Exported {num_trans} to trans-{range_str}.json.gz')
+
+    print(' '.join(f'#{s}: {c}' for (s, c) in sorted(trans_queue.get_state_counts().items())))
+    trans_queue.close()
+
+
+if __name__ == "__main__":
+    main()
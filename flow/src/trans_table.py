@@ -0,0 +1,124 @@
+"""
+Read-only translation table compiled from the trans-{range}.json files, the file is memory
+mapped and looked up with a binary search, so opening it parses nothing and the pages are
+shared by all the processes that read it.
+
+    python trans_table.py conf/trans/trans.table conf/trans/trans-*.json*
+
+Layout, all integers are little-endian uint64
+
+    header   magic, version, #entries
+    hashes   #entries sorted hashes of the normalized source texts
+    offsets  2 * #entries + 1 offsets into the blobs, source of i: [2i, 2i+1), target: [2i+1, 2i+2)
+    blobs    utf-8 source and target texts
+"""
+import argparse
+import mmap
+import struct
+import sys
+from bisect import bisect_left
+from pathlib import Path
+
+from trans_memory import normalize_text, read_trans_file, text_key
+
+Magic = b'MTRTABLE'
+Version = 1
+HeaderFormat = '<8sQQ'
+HeaderSize = struct.calcsize(HeaderFormat)
+
+
+def table_hash(text):
+    # first 8 bytes of the trans_memory key, collisions are resolved by comparing the source
+    return int(text_key(text)[:16], 16)
+
+
+def build_table(table_file, trans_files, src_lang='mr', tgt_lang='en'):
+    """Writes the table of the trans files, a later file overrides the earlier ones."""
+    translations = {}
+    for trans_file in trans_files:
+        for trans_dict in read_trans_file(trans_file):
+            translations[trans_dict[src_lang]] = trans_dict[tgt_lang]
+
+    entries = sorted((table_hash(s), s, t) for (s, t) in translations.items())
+
+    offsets, blobs, offset = [], [], 0
+    for (_, src, tgt) in entries:
+        for text in (src, tgt):
+            blob = text.encode('utf-8')
+            offsets.append(offset)
+            blobs.append(blob)
+            offset += len(blob)
+    offsets.append(offset)
+
+    num_entries = len(entries)
+    tmp_file = Path(table_file).parent / f'{Path(table_file).name}.tmp'
+    with open(tmp_file, 'wb') as f:
+        f.write(struct.pack(HeaderFormat, Magic, Version, num_entries))
+        f.write(struct.pack(f'<{num_entries}Q', *(h for (h, _, _) in entries)))
+        f.write(struct.pack(f'<{len(offsets)}Q', *offsets))
+        f.writelines(blobs)
+    tmp_file.replace(table_file)
+    return num_entries
+
+
+class TransTable:
+    def __init__(self, table_file):
+        self.table_file = Path(table_file)
+        with open(self.table_file, 'rb') as f:
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, self.num_entries = struct.unpack_from(HeaderFormat, self.mm)
+        if magic != Magic or version != Version:
+            raise ValueError(f'{self.table_file} is not a translation table version {Version}')
+
+        # the arrays are cast in the native byte order, the table is written little-endian
+        assert sys.byteorder == 'little'
+
+        hashes_end = HeaderSize + 8 * self.num_entries
+        offsets_end = hashes_end + 8 * (2 * self.num_entries + 1)
+        self.hashes = memoryview(self.mm)[HeaderSize:hashes_end].cast('Q')
+        self.offsets = memoryview(self.mm)[hashes_end:offsets_end].cast('Q')
+        self.blobs_start = offsets_end
+
+    def __len__(self):
+        return self.num_entries
+
+    def get_text(self, text_idx):
+        start = self.blobs_start + self.offsets[text_idx]
+        end = self.blobs_start + self.offsets[text_idx + 1]
+        return self.mm[start:end].decode('utf-8')
+
+    def get(self, text):
+        text_hash, norm_text = table_hash(text), normalize_text(text)
+        start_idx = end_idx = bisect_left(self.hashes, text_hash)
+        while end_idx < self.num_entries and self.hashes[end_idx] == text_hash:
+            end_idx += 1
+
+        # the exact source first, as in the dict of the trans files and in the memory
+        srcs = [(idx, self.get_text(2 * idx)) for idx in range(start_idx, end_idx)]
+        idx = next((idx for (idx, src) in srcs if src == text), None)
+        if idx is None:
+            idx = next((idx for (idx, src) in srcs if normalize_text(src) == norm_text), None)
+        return self.get_text(2 * idx + 1) if idx is not None else None
+
+    def __contains__(self, text):
+        return self.get(text) is not None
+
+    def close(self):
+        self.hashes.release()
+        self.offsets.release()
+        self.mm.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compile trans-{range}.json files to a table.')
+    parser.add_argument('table_file', type=Path)
+    parser.add_argument('trans_files', nargs='+', type=Path)
+    args = parser.parse_args()
+
+    num_entries = build_table(args.table_file, sorted(args.trans_files))
+    print(f'Wrote {num_entries} translations to {args.table_file}')
+
+
+if __name__ == "__main__":
+    main()
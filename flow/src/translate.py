@@ -4,6 +4,11 @@ import sys
 from itertools import tee, zip_longest
 from pathlib import Path
 
+import pysbd
+
+from batch_scheduler import BatchScheduler
+from trans_memory import TransMemory, get_file_range, unique_texts
+
 
 def pairwise(iterable):
     # pairwise('ABCDEFG') --> AB BC CD DE EF FG
@@ -32,6 +37,12 @@ ModelDir = os.environ.get(
     "MODEL_DIR", "../../../import/models/ai4bharat/IndicTrans2-en/ct2_int8_model"
 )
 
+# paragraphs (or cells) scheduled together, the translations are saved after each chunk
+ChunkSize = 1000
+
+# sqlite translation memory, when set the translations are saved to it after each batch
+TransMemoryPath = os.environ.get("TRANS_MEMORY", "")
+
 
 class Translator:
     def __init__(self, translations_file, todo_file, src_lang, tgt_lang):
@@ -52,6 +63,14 @@ class Translator:
 
         self.model = None
         self.indic2en_trans = None
+        self.segmenter = None
+        self.scheduler = None
+
+        self.trans_memory = TransMemory(TransMemoryPath) if TransMemoryPath else None
+        if self.translations_file.name.startswith("trans-"):
+            self.range_str = get_file_range(self.translations_file)
+        else:
+            self.range_str = None
 
     def load_model(self):
         from docint.models.indictrans.engine import Model
@@ -60,6 +79,10 @@ class Translator:
         return Model(str(ModelDir), device="cpu")
 
     def load_translations(self):
+        if self.trans_memory:
+            todo_texts = self.para_todos + self.cell_todos
+            return self.trans_memory.get_many(todo_texts, self.range_str)
+
         indic2en_trans = {}
         if self.translations_file.exists() and self.translations_file.stat().st_size > 0:
             json_list = json.loads(self.translations_file.read_text())
@@ -77,44 +100,59 @@ class Translator:
             json.dumps(save_trans, indent=2, ensure_ascii=False)
         )
 
+    def save_batch(self, src_texts, trans_texts):
+        # the memory appends only the batch, the json file is rewritten in full
+        if self.trans_memory:
+            self.trans_memory.add(zip(src_texts, trans_texts), self.range_str)
+        else:
+            self.save_translations()
+
+    def model_batch_translate(self, sents):
+        return self.model.batch_translate(sents, self.src_lang, self.tgt_lang)
+
     def para_translate(self, para_texts):
         para_texts = list(para_texts)
+        print(f"#paragraphs: {len(para_texts)}")
 
-        partitions = self.model.group_paragraphs(
-            para_texts, self.src_lang, self.tgt_lang
-        )
-        print(f"#paragraphs: {len(para_texts)} #partitions: {len(partitions)}")
+        for start_idx in range(0, len(para_texts), ChunkSize):
+            batch_paras = para_texts[start_idx : start_idx + ChunkSize]
 
-        for (s, e) in pairwise(partitions):
-            batch_paras = para_texts[s:e]
-            batch_trans = self.model.translate_paragraphs(
-                batch_paras, self.src_lang, self.tgt_lang
-            )
+            sents, partitions = [], [0]
+            for para in batch_paras:
+                sents.extend(s.strip() for s in self.segmenter.segment(para) if s.strip())
+                partitions.append(len(sents))
 
+            # a sentence repeated across the paragraphs is translated once
+            uniq_sents = list(dict.fromkeys(sents))
+            uniq_trans = self.scheduler.translate(uniq_sents, self.model_batch_translate)
+            sent_trans = dict(zip(uniq_sents, uniq_trans))
+
+            batch_trans = [
+                " ".join(sent_trans[s] for s in sents[b:e]) for (b, e) in pairwise(partitions)
+            ]
             assert len(batch_trans) == len(batch_paras)
 
             for (p, t) in zip(batch_paras, batch_trans):
                 self.indic2en_trans[p] = t
 
             if batch_trans:
-                self.save_translations()
+                self.save_batch(batch_paras, batch_trans)
+            print(self.scheduler.throughput_str())
 
     def sentences_translate(self, sents):
         sents = list(sents)
-        partitions = self.model.group_paragraphs(sents, self.src_lang, self.tgt_lang)
 
-        for (s, e) in pairwise(partitions):
-            batch_sents = sents[s:e]
-            batch_trans = self.model.batch_translate(
-                batch_sents, self.src_lang, self.tgt_lang
-            )
+        for start_idx in range(0, len(sents), ChunkSize):
+            batch_sents = sents[start_idx : start_idx + ChunkSize]
+            batch_trans = self.scheduler.translate(batch_sents, self.model_batch_translate)
             assert len(batch_sents) == len(batch_trans)
 
             for (s, t) in zip(batch_sents, batch_trans):
                 self.indic2en_trans[s] = t
 
             if batch_trans:
-                self.save_translations()
+                self.save_batch(batch_sents, batch_trans)
+            print(self.scheduler.throughput_str())
 
     def translate(self):
         if not self.para_todos and not self.cell_todos:
@@ -123,15 +161,24 @@ class Translator:
         self.model = self.load_model()
         self.indic2en_trans = self.load_translations()
 
+        self.segmenter = pysbd.Segmenter(language="mr", clean=False)
+        self.scheduler = BatchScheduler(Path(ModelDir) / "vocab" / "model.SRC")
+
         para_texts = [p for p in self.para_todos if p not in self.indic2en_trans]
         cell_texts = [c for c in self.cell_todos if c not in self.indic2en_trans]
 
+        if self.trans_memory:
+            # texts with the same normalized form are translated once across all ranges
+            print(f"Translation memory hits: {self.trans_memory.hit_rate_str()}")
+            para_texts, cell_texts = unique_texts(para_texts), unique_texts(cell_texts)
+
         print("******** PARAGRAPHS ***********")
         self.para_translate(para_texts)
 
         print("******** CELLS ***********")
 
         self.sentences_translate(cell_texts)
+        print(f"Total {self.scheduler.throughput_str()}")
         print("******** DONE ***********")
 
 
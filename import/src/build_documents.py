@@ -11,7 +11,7 @@ import yaml
 from more_itertools import first
 
 from docint.util import get_repo_path, get_repo_dir, find_date
-from docint import pdfwrapper
+from pdf_probe import probe_pdf
 
 from urllib.parse import quote
 
@@ -257,14 +257,11 @@ def get_document_infos(pdf_repo_paths, start_num):
 
     def get_pdf_info(doc_path):
         try:
-            pdf = pdfwrapper.open(doc_path)
+            return probe_pdf(doc_path)
         except:  # noqa pdfwrapper should raise exceptions
             print(f"Unable to load: {doc_path}")
             return 0, []
 
-        large_image_idxs = [p.page_idx for p in pdf.pages if p.has_large_image]
-        return len(pdf.pages), large_image_idxs
-
     doc_infos = []
     for repo_path in pdf_repo_paths:
         doc_info = {'repo_path': repo_path}
@@ -3,10 +3,11 @@ import os
 import sys
 from pathlib import Path
 
-from docint import pdfwrapper
 from docint.util import get_repo_dir, get_repo_path
 from more_itertools import first
 
+from pdf_probe import probe_pdf
+
 """
   {
     "repo_path": "",
@@ -36,13 +37,10 @@ def get_document_infos(pdf_repo_paths, start_num):
 
     def get_pdf_info(doc_path):
         try:
-            pdf = pdfwrapper.open(doc_path)
+            return probe_pdf(doc_path)
         except:  # noqa pdfwrapper should raise exceptions
             print(f"Unable to load: {doc_path}")
             return 0, []
-
-        large_image_idxs = [p.page_idx for p in pdf.pages if p.has_large_image]
-        return len(pdf.pages), large_image_idxs
                 
     years = '2023-2022-2021-2020-2019-2018-2017-2016-2015-2014-2013-2012'.split('-')
 
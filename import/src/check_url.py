@@ -1,18 +1,129 @@
-from pathlib import Path
+"""
+check_url.py - Checks the urls of the documents concurrently, the results are cached in a
+report that is reused until the entries are older than the ttl.
+
+Usage:
+    python check_url.py documents.json -r url_report.json -j documents_checked.json
+
+The report is keyed by url with the status, the redirect target, the content length and the
+last-modified of each url. A url is probed with HEAD, servers that refuse HEAD are probed with
+a GET of the first byte.
+"""
+import argparse
 import json
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+
 import requests
-import sys
-
-def check_urls(file_path):
-    data = json.loads(Path(file_path).read_text())
-    for obj in data:
-        url = obj.get("url")
-        if url:
-            try:
-                response = requests.head(url, allow_redirects=True, timeout=5)
-                if response.status_code >= 400:
-                    print(f"Broken: {url} ({response.status_code})")
-            except requests.RequestException:
-                print(f"Broken: {url} (Request failed)")
-
-check_urls(sys.argv[1])
+from requests.adapters import HTTPAdapter
+
+NumWorkers = 16
+Timeout = 10
+TTLHours = 24
+
+# failed urls are probed again sooner
+FailedTTLHours = 1
+
+# statuses returned by servers that do not implement HEAD
+HeadRefused = {403, 405, 501}
+
+
+def get_content_length(response):
+    if response.status_code == 206:
+        total = response.headers.get('Content-Range', '').rsplit('/', 1)[-1]
+        return int(total) if total.isdigit() else None
+    length = response.headers.get('Content-Length', '')
+    return int(length) if length.isdigit() else None
+
+
+def probe_url(session, url):
+    result = {'checked': time.time()}
+    try:
+        response = session.head(url, allow_redirects=True, timeout=Timeout)
+        result['method'] = 'HEAD'
+        if response.status_code in HeadRefused:
+            headers = {'Range': 'bytes=0-0', 'Accept-Encoding': 'identity'}
+            response = session.get(
+                url, headers=headers, allow_redirects=True, stream=True, timeout=Timeout
+            )
+            response.close()
+            result['method'] = 'GET'
+    except requests.RequestException as e:
+        return dict(result, status=None, ok=False, error=f'{type(e).__name__}: {e}')
+
+    return dict(
+        result,
+        status=response.status_code,
+        ok=response.status_code < 400,
+        final_url=response.url if response.url != url else '',
+        content_length=get_content_length(response),
+        content_type=response.headers.get('Content-Type', ''),
+        last_modified=response.headers.get('Last-Modified', ''),
+    )
+
+
+def is_stale(entry, ttl_hours):
+    ttl_hours = ttl_hours if entry.get('ok') else min(ttl_hours, FailedTTLHours)
+    return (time.time() - entry.get('checked', 0)) > ttl_hours * 3600
+
+
+def check_urls(urls, report, num_workers=NumWorkers, ttl_hours=TTLHours):
+    """Probes the urls missing in the report or stale, updates the report in place."""
+    stale_urls = [
+        u for u in dict.fromkeys(urls) if u not in report or is_stale(report[u], ttl_hours)
+    ]
+    print(f"#urls: {len(set(urls))} #to check: {len(stale_urls)}")
+
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=num_workers, pool_maxsize=num_workers)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+
+    with ThreadPoolExecutor(max_workers=num_workers) as executor:
+        futures = dict((executor.submit(probe_url, session, u), u) for u in stale_urls)
+        for future in as_completed(futures):
+            url, entry = futures[future], future.result()
+            report[url] = entry
+            if not entry['ok']:
+                print(f"Broken: {url} ({entry.get('status') or entry.get('error')})")
+    return stale_urls
+
+
+def join_report(documents, report):
+    # the check of each url is added to its document
+    for doc in documents:
+        entry = report.get(doc.get('url', ''), None)
+        if entry:
+            doc['url_check'] = dict((k, v) for (k, v) in entry.items() if k != 'method')
+    return documents
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Check the urls of the documents.')
+    parser.add_argument('documents_file', type=Path)
+    parser.add_argument('-r', '--report', type=Path, default=Path('url_report.json'))
+    parser.add_argument('-j', '--join', type=Path, help='write the documents with url_check')
+    parser.add_argument('-w', '--workers', type=int, default=NumWorkers)
+    parser.add_argument('-t', '--ttl-hours', type=float, default=TTLHours)
+    args = parser.parse_args()
+
+    documents = json.loads(args.documents_file.read_text())
+    report = json.loads(args.report.read_text()) if args.report.exists() else {}
+
+    start = time.perf_counter()
+    urls = [d['url'] for d in documents if d.get('url')]
+    checked_urls = check_urls(urls, report, args.workers, args.ttl_hours)
+    args.report.write_text(json.dumps(report, indent=2, sort_keys=True))
+
+    num_broken = sum(1 for u in set(urls) if not report[u]['ok'])
+    secs = time.perf_counter() - start
+    print(f"Checked #urls: {len(checked_urls)} in {secs:.1f}s #broken: {num_broken}")
+
+    if args.join:
+        joined = join_report(documents, report)
+        args.join.write_text(json.dumps(joined, indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
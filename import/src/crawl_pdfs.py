@@ -0,0 +1,261 @@
+#!/usr/bin/env python3
+"""
+crawl_pdfs.py - Discovers and downloads the PDFs linked from pages of a site, replaces
+download_page_pdf.py, getPDFLinks.py and getLinks_with_string.py.
+
+Pages are fetched with one pooled aiohttp session, the requests to a host are limited both in
+concurrency and rate. Links are followed recursively up to --depth when they contain the
+--url-string or their anchor text contains the --link-string, the PDFs found on the visited
+pages are downloaded by --workers tasks through a bounded queue. The PDFs are recorded in
+the download_index.json of the output dir, a re-crawl transfers only the changed PDFs and
+resumes the interrupted ones.
+
+Usage:
+    python crawl_pdfs.py https://mls.org.in/... -o input -l लक्षवेधी -d 1
+"""
+
+import argparse
+import asyncio
+import os
+import time
+from pathlib import Path
+from urllib.parse import urldefrag, urljoin, urlparse
+
+import aiohttp
+from bs4 import BeautifulSoup
+
+from download_index import ChunkSize, DownloadIndex, IndexFile, get_part_paths
+
+MaxPerHost = 4
+RequestsPerSec = 4.0
+NumWorkers = 8
+
+# pdf urls waiting to be downloaded, discovery blocks when the downloads fall behind
+QueueSize = 64
+
+Timeout = aiohttp.ClientTimeout(total=600, sock_connect=30)
+
+
+def is_pdf_url(url):
+    return urlparse(url).path.lower().endswith('.pdf')
+
+
+class HostLimiter:
+    """At most max_per_host requests in flight and requests_per_sec started per host."""
+
+    def __init__(self, max_per_host=MaxPerHost, requests_per_sec=RequestsPerSec):
+        self.max_per_host = max_per_host
+        self.interval = 1.0 / requests_per_sec if requests_per_sec else 0.0
+        self.semaphores, self.locks, self.next_times = {}, {}, {}
+
+    def slot(self, url):
+        host = urlparse(url).netloc
+        if host not in self.semaphores:
+            self.semaphores[host] = asyncio.Semaphore(self.max_per_host)
+            self.locks[host] = asyncio.Lock()
+            self.next_times[host] = 0.0
+        return HostSlot(self, host)
+
+    async def wait_turn(self, host):
+        async with self.locks[host]:
+            delay = self.next_times[host] - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            self.next_times[host] = time.monotonic() + self.interval
+
+
+class HostSlot:
+    def __init__(self, limiter, host):
+        self.limiter, self.host = limiter, host
+
+    async def __aenter__(self):
+        await self.limiter.semaphores[self.host].acquire()
+        await self.limiter.wait_turn(self.host)
+
+    async def __aexit__(self, *exc_info):
+        self.limiter.semaphores[self.host].release()
+
+
+class Crawler:
+    def __init__(
+        self,
+        session,
+        limiter,
+        output_dir,
+        url_string='',
+        link_string='',
+        max_depth=0,
+        keep_paths=False,
+    ):
+        self.session = session
+        self.limiter = limiter
+        self.output_dir = Path(output_dir)
+        self.url_string = url_string
+        self.link_string = link_string
+        self.max_depth = max_depth
+        self.keep_paths = keep_paths
+
+        self.index = DownloadIndex(self.output_dir / IndexFile)
+        self.seen_pages, self.seen_pdfs = set(), set()
+        self.downloaded, self.not_modified, self.failed = [], [], []
+
+    def is_followed(self, url, anchor_text):
+        if self.url_string and self.url_string in url:
+            return True
+        return bool(self.link_string and self.link_string in anchor_text)
+
+    async def fetch_page(self, url):
+        async with self.limiter.slot(url):
+            async with self.session.get(url) as response:
+                response.raise_for_status()
+                return await response.text(errors='replace')
+
+    def get_links(self, page_url, html):
+        soup = BeautifulSoup(html, 'html.parser')
+        for link in soup.find_all('a', href=True):
+            url, _ = urldefrag(urljoin(page_url, link['href']))
+            if urlparse(url).scheme in ('http', 'https'):
+                yield url, link.get_text(' ', strip=True)
+
+    async def visit_page(self, url, depth, pdf_queue):
+        try:
+            html = await self.fetch_page(url)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            print(f"Error fetching {url}: {e}")
+            return []
+
+        next_pages = []
+        for (link_url, anchor_text) in self.get_links(url, html):
+            if is_pdf_url(link_url):
+                if link_url not in self.seen_pdfs:
+                    self.seen_pdfs.add(link_url)
+                    await pdf_queue.put(link_url)
+            elif depth < self.max_depth and link_url not in self.seen_pages:
+                if self.is_followed(link_url, anchor_text):
+                    self.seen_pages.add(link_url)
+                    next_pages.append(link_url)
+        return next_pages
+
+    async def discover(self, start_urls, pdf_queue):
+        # breadth first, the pages of a level are fetched concurrently
+        pages = [u for u in start_urls if u not in self.seen_pages]
+        self.seen_pages.update(pages)
+        for depth in range(self.max_depth + 1):
+            if not pages:
+                break
+            print(f"Scanning #pages: {len(pages)} at depth {depth}")
+            results = await asyncio.gather(*[self.visit_page(u, depth, pdf_queue) for u in pages])
+            pages = [u for next_pages in results for u in next_pages]
+
+    def get_output_path(self, pdf_url):
+        url_path = urlparse(pdf_url).path
+        if self.keep_paths:
+            return self.output_dir / url_path.lstrip('/')
+        return self.output_dir / os.path.basename(url_path)
+
+    async def write_body(self, pdf_url, output_path, response):
+        response.raise_for_status()
+        content_type = response.headers.get('Content-Type', '').lower()
+        if 'application/pdf' not in content_type:
+            print(f"Warning: {pdf_url} might not be a PDF ({content_type})")
+
+        status, resp_headers = response.status, response.headers
+        mode, sha = self.index.start_body(pdf_url, output_path, status, resp_headers)
+        part_path, _ = get_part_paths(output_path)
+        with open(part_path, mode) as f:
+            async for chunk in response.content.iter_chunked(ChunkSize):
+                f.write(chunk)
+                sha.update(chunk)
+        return self.index.finish(pdf_url, output_path, status, resp_headers, sha)
+
+    async def download(self, pdf_url):
+        output_path = self.get_output_path(pdf_url)
+        output_path.parent.mkdir(parents=True, exist_ok=True)
+
+        headers = self.index.request_headers(pdf_url, output_path)
+        headers['Accept-Encoding'] = 'identity'
+        try:
+            async with self.limiter.slot(pdf_url):
+                async with self.session.get(pdf_url, headers=headers) as response:
+                    if response.status == 304:
+                        self.index.not_modified(pdf_url, output_path, response.headers)
+                        self.not_modified.append(pdf_url)
+                        return
+
+                    if response.status == 416 and 'Range' in headers:
+                        index, resp_headers = self.index, response.headers
+                        result = index.range_not_satisfiable(pdf_url, output_path, resp_headers)
+                    else:
+                        result = await self.write_body(pdf_url, output_path, response)
+            if result is None:
+                # the .part file was dropped, it is fetched again without a Range
+                return await self.download(pdf_url)
+            self.downloaded.append(pdf_url)
+            print(f"Downloaded: {output_path.name}")
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError, OSError) as e:
+            # the .part file is kept, the next crawl resumes from it
+            self.failed.append(pdf_url)
+            print(f"Error downloading {pdf_url}: {e}")
+
+    async def download_worker(self, pdf_queue):
+        while True:
+            pdf_url = await pdf_queue.get()
+            if pdf_url is None:
+                break
+            await self.download(pdf_url)
+
+    async def crawl(self, start_urls, num_workers=NumWorkers):
+        pdf_queue = asyncio.Queue(maxsize=QueueSize)
+        workers = [asyncio.create_task(self.download_worker(pdf_queue)) for _ in range(num_workers)]
+
+        await self.discover(start_urls, pdf_queue)
+        for _ in workers:
+            await pdf_queue.put(None)
+        await asyncio.gather(*workers)
+        self.index.save()
+
+
+async def crawl_pdfs(args):
+    limiter = HostLimiter(args.max_per_host, args.rate)
+    connector = aiohttp.TCPConnector(limit_per_host=args.max_per_host)
+    session_args = {'connector': connector, 'timeout': Timeout, 'auto_decompress': False}
+    async with aiohttp.ClientSession(**session_args) as session:
+        crawler = Crawler(
+            session,
+            limiter,
+            args.output_dir,
+            url_string=args.url_string,
+            link_string=args.link_string,
+            max_depth=args.depth,
+            keep_paths=args.keep_paths,
+        )
+        await crawler.crawl(args.urls, args.workers)
+    return crawler
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Discover and download the PDFs of a site.')
+    parser.add_argument('urls', nargs='+', help='pages to start the crawl from')
+    parser.add_argument('-o', '--output-dir', default='.', help='directory to save the PDFs')
+    parser.add_argument('-s', '--url-string', default='', help='follow links with this in the url')
+    parser.add_argument('-l', '--link-string', default='', help='follow links with this text')
+    parser.add_argument('-d', '--depth', type=int, default=0, help='levels of links to follow')
+    parser.add_argument('-w', '--workers', type=int, default=NumWorkers, help='download tasks')
+    parser.add_argument('-c', '--max-per-host', type=int, default=MaxPerHost)
+    parser.add_argument('-r', '--rate', type=float, default=RequestsPerSec, help='requests/sec')
+    parser.add_argument(
+        '-k', '--keep-paths', action='store_true', help='replicate the url directories'
+    )
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    crawler = asyncio.run(crawl_pdfs(args))
+
+    print(f"\nDownload summary: {time.perf_counter() - start:.1f}s")
+    print(f"Pages scanned: {len(crawler.seen_pages)} PDF links found: {len(crawler.seen_pdfs)}")
+    print(f"Downloaded: {len(crawler.downloaded)} Not modified: {len(crawler.not_modified)}")
+    print(f"Failed: {len(crawler.failed)} {crawler.index.counts_str()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,221 @@
+"""
+download_index.py - Conditional and resumable PDF downloads.
+
+The index keeps per url the ETag, Last-Modified, length and SHA-256 of the last download.
+A url already downloaded is fetched with a conditional GET, the server answers 304 unless the
+PDF was republished. A download is streamed in chunks to a .part file, the validators of the
+response are kept next to it in .part.json, an interrupted download resumes with a Range
+request guarded by If-Range so that the bytes of two versions are never mixed. A .part file
+that already holds every byte is answered with 416, it is finished if its length matches.
+
+fetch_pdf downloads with requests, crawl_pdfs.py uses the same index with aiohttp.
+"""
+import hashlib
+import json
+import re
+import threading
+from email.utils import formatdate
+from pathlib import Path
+
+import requests
+
+IndexFile = 'download_index.json'
+ChunkSize = 64 * 1024
+Timeout = (30, 300)
+
+# the index is written after these many downloads, and on save()
+SaveEvery = 50
+
+ContentRangePattern = re.compile(r'bytes (\d+)-(\d+)/(\d+|\*)')
+UnsatisfiedRangePattern = re.compile(r'bytes \*/(\d+)')
+
+
+def hash_file(path, sha=None):
+    sha = sha if sha else hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(ChunkSize), b''):
+            sha.update(chunk)
+    return sha
+
+
+def get_part_paths(pdf_file):
+    pdf_file = Path(pdf_file)
+    return pdf_file.parent / f'{pdf_file.name}.part', pdf_file.parent / f'{pdf_file.name}.part.json'
+
+
+def get_validators(headers):
+    return {'etag': headers.get('ETag', ''), 'last_modified': headers.get('Last-Modified', '')}
+
+
+def get_total_length(status, headers):
+    if status == 206:
+        match = ContentRangePattern.match(headers.get('Content-Range', ''))
+        return int(match.group(3)) if match and match.group(3) != '*' else None
+    length = headers.get('Content-Length', '')
+    return int(length) if length.isdigit() else None
+
+
+class DownloadIndex:
+    def __init__(self, index_file):
+        self.index_file = Path(index_file)
+        self.entries = json.loads(self.index_file.read_text()) if self.index_file.exists() else {}
+        self.lock = threading.Lock()
+        self.num_unsaved = 0
+        self.counts = {'downloaded': 0, 'resumed': 0, 'not_modified': 0, 'same_content': 0}
+
+    def request_headers(self, url, pdf_file):
+        """Range headers if a partial download can be resumed, conditional headers if the
+        PDF was downloaded before, no headers otherwise.
+        """
+        pdf_file = Path(pdf_file)
+        part_file, meta_file = get_part_paths(pdf_file)
+        if part_file.exists() and meta_file.exists():
+            validators = json.loads(meta_file.read_text())
+            validator = validators['etag'] or validators['last_modified']
+            if validator and part_file.stat().st_size > 0:
+                return {'Range': f'bytes={part_file.stat().st_size}-', 'If-Range': validator}
+
+        if not pdf_file.exists():
+            return {}
+
+        entry = self.entries.get(url, {})
+        if entry.get('size') != pdf_file.stat().st_size:
+            # downloaded before the index existed, the file time stands in for Last-Modified
+            if entry:
+                return {}
+            return {'If-Modified-Since': formatdate(pdf_file.stat().st_mtime, usegmt=True)}
+
+        headers = {}
+        if entry.get('etag'):
+            headers['If-None-Match'] = entry['etag']
+        if entry.get('last_modified'):
+            headers['If-Modified-Since'] = entry['last_modified']
+        return headers
+
+    def start_body(self, url, pdf_file, status, headers):
+        """Returns the file mode and the sha of the bytes already in the .part file."""
+        part_file, meta_file = get_part_paths(pdf_file)
+        if status == 206:
+            match = ContentRangePattern.match(headers.get('Content-Range', ''))
+            if not match or int(match.group(1)) != part_file.stat().st_size:
+                part_file.unlink()
+                meta_file.unlink(missing_ok=True)
+                raise ValueError(f'Unexpected Content-Range {headers.get("Content-Range")}')
+            self.count('resumed')
+            return 'ab', hash_file(part_file)
+
+        meta_file.write_text(json.dumps(get_validators(headers)))
+        return 'wb', hashlib.sha256()
+
+    def range_not_satisfiable(self, url, pdf_file, headers):
+        """Finishes the download from the .part file if the length in the 416 Content-Range
+        matches it, otherwise drops the .part file and returns None, the download restarts.
+        """
+        part_file, meta_file = get_part_paths(pdf_file)
+        match = UnsatisfiedRangePattern.match(headers.get('Content-Range', ''))
+        if match and part_file.exists() and int(match.group(1)) == part_file.stat().st_size:
+            self.count('resumed')
+            return self.finish(url, pdf_file, 206, {}, hash_file(part_file))
+
+        part_file.unlink(missing_ok=True)
+        meta_file.unlink(missing_ok=True)
+        return None
+
+    def finish(self, url, pdf_file, status, headers, sha):
+        """Moves the .part file in place and records it, returns 'downloaded' or, if the
+        republished PDF has the same bytes, 'same_content'.
+        """
+        pdf_file = Path(pdf_file)
+        part_file, meta_file = get_part_paths(pdf_file)
+
+        total_length = get_total_length(status, headers)
+        size = part_file.stat().st_size
+        if total_length is not None and size != total_length:
+            part_file.unlink()
+            meta_file.unlink(missing_ok=True)
+            raise ValueError(f'Truncated download {size}/{total_length} bytes')
+
+        validators = json.loads(meta_file.read_text()) if meta_file.exists() else {}
+        validators = validators if status == 206 else get_validators(headers)
+
+        old_sha256 = self.entries.get(url, {}).get('sha256', '')
+        if not old_sha256 and pdf_file.exists():
+            old_sha256 = hash_file(pdf_file).hexdigest()
+
+        part_file.replace(pdf_file)
+        meta_file.unlink(missing_ok=True)
+
+        sha256 = sha.hexdigest()
+        self.update(url, dict(validators, size=size, sha256=sha256, name=pdf_file.name))
+
+        result = 'same_content' if sha256 == old_sha256 else 'downloaded'
+        self.count(result)
+        return result
+
+    def not_modified(self, url, pdf_file, headers):
+        pdf_file = Path(pdf_file)
+        entry = dict((k, v) for (k, v) in get_validators(headers).items() if v)
+        if url not in self.entries:
+            # the If-Modified-Since sent for a file that was not in the index
+            entry.setdefault('last_modified', formatdate(pdf_file.stat().st_mtime, usegmt=True))
+            entry['sha256'] = hash_file(pdf_file).hexdigest()
+            entry.update(size=pdf_file.stat().st_size, name=pdf_file.name)
+        if entry:
+            self.update(url, entry)
+        self.count('not_modified')
+        return 'not_modified'
+
+    def count(self, result):
+        with self.lock:
+            self.counts[result] += 1
+
+    def update(self, url, entry):
+        with self.lock:
+            self.entries[url] = dict(self.entries.get(url, {}), **entry)
+            self.num_unsaved += 1
+            save = self.num_unsaved >= SaveEvery
+        if save:
+            self.save()
+
+    def save(self):
+        with self.lock:
+            tmp_file = self.index_file.parent / f'{self.index_file.name}.tmp'
+            tmp_file.write_text(json.dumps(self.entries, indent=2, sort_keys=True))
+            tmp_file.replace(self.index_file)
+            self.num_unsaved = 0
+
+    def counts_str(self):
+        return ' '.join(f'{k}: {v}' for (k, v) in self.counts.items())
+
+
+def fetch_pdf(url, pdf_file, index, session=None, timeout=Timeout):
+    """Downloads or refreshes pdf_file, returns 'downloaded', 'same_content', 'not_modified'
+    or 'failed'. Memory is constant, the body is written chunk by chunk.
+    """
+    session = session if session else requests
+    pdf_file = Path(pdf_file)
+    pdf_file.parent.mkdir(parents=True, exist_ok=True)
+
+    # the length and the sha are of the bytes as served, not of a decompressed body
+    headers = dict(index.request_headers(url, pdf_file), **{'Accept-Encoding': 'identity'})
+    try:
+        with session.get(url, headers=headers, stream=True, timeout=timeout) as r:
+            if r.status_code == 304:
+                return index.not_modified(url, pdf_file, r.headers)
+            if r.status_code == 416 and 'Range' in headers:
+                result = index.range_not_satisfiable(url, pdf_file, r.headers)
+                # the .part file was dropped, it is fetched again without a Range
+                return result if result else fetch_pdf(url, pdf_file, index, session, timeout)
+            r.raise_for_status()
+
+            mode, sha = index.start_body(url, pdf_file, r.status_code, r.headers)
+            part_file, _ = get_part_paths(pdf_file)
+            with open(part_file, mode) as f:
+                for chunk in r.iter_content(chunk_size=ChunkSize):
+                    f.write(chunk)
+                    sha.update(chunk)
+        return index.finish(url, pdf_file, r.status_code, r.headers, sha)
+    except (requests.RequestException, ValueError, OSError) as e:
+        # the .part file is kept, the next fetch resumes from it
+        print(f"Error downloading {url}: {e}")
+        return 'failed'
@@ -6,6 +6,7 @@ Usage:
     python download_page_pdf.py <url>
 """
 
+import hashlib
 import os
 import sys
 import requests
@@ -14,48 +15,25 @@ from urllib.parse import urljoin, urlparse
 import argparse
 import concurrent.futures
 
+from download_index import DownloadIndex, IndexFile, fetch_pdf
+
 def is_valid_pdf_url(url):
     """Check if URL points to a PDF file."""
     parsed = urlparse(url)
     return parsed.path.lower().endswith('.pdf')
 
-def download_pdf(pdf_url, output_dir='.'):
-    """Download a PDF file and save it to the specified directory."""
-    try:
-        # Extract filename from URL
-        filename = os.path.basename(urlparse(pdf_url).path)
-        # Ensure filename is not empty
-        if not filename:
-            filename = f"document_{hash(pdf_url)}.pdf"
-        
-        output_path = os.path.join(output_dir, filename)
-        
-        # Check if file already exists
-        if os.path.exists(output_path):
-            print(f"File already exists: {filename}")
-            return None
-        
-        # Download the PDF
-        print(f"Downloading: {filename} from {pdf_url}")
-        response = requests.get(pdf_url, stream=True)
-        response.raise_for_status()  # Raise exception for HTTP errors
-        
-        # Check if content is actually a PDF
-        content_type = response.headers.get('Content-Type', '').lower()
-        if 'application/pdf' not in content_type and not pdf_url.lower().endswith('.pdf'):
-            print(f"Warning: {pdf_url} might not be a PDF (Content-Type: {content_type})")
-        
-        # Save the PDF
-        with open(output_path, 'wb') as f:
-            for chunk in response.iter_content(chunk_size=8192):
-                if chunk:
-                    f.write(chunk)
-        
-        print(f"Downloaded: {filename}")
-        return output_path
-    except Exception as e:
-        print(f"Error downloading {pdf_url}: {e}")
-        return None
+def download_pdf(pdf_url, index, session, output_dir='.'):
+    """Download a PDF file, a file downloaded before is refreshed with a conditional GET."""
+    # Extract filename from URL
+    filename = os.path.basename(urlparse(pdf_url).path)
+    # Ensure filename is not empty
+    if not filename:
+        filename = f"document_{hashlib.sha1(pdf_url.encode('utf-8')).hexdigest()[:12]}.pdf"
+
+    output_path = os.path.join(output_dir, filename)
+    result = fetch_pdf(pdf_url, output_path, index, session)
+    print(f"{result}: {filename}")
+    return output_path if result in ('downloaded', 'same_content') else None
 
 def get_pdf_links(url):
     """Extract all PDF links from a webpage."""
@@ -106,9 +84,14 @@ def main():
     
     print(f"Found {len(pdf_links)} PDF links.")
     
-    # Download PDFs in parallel
+    # Download PDFs in parallel, the index records what was downloaded for the next run
+    index = DownloadIndex(os.path.join(args.output_dir, IndexFile))
+    session = requests.Session()
     with concurrent.futures.ThreadPoolExecutor(max_workers=args.threads) as executor:
-        futures = [executor.submit(download_pdf, pdf_url, args.output_dir) for pdf_url in pdf_links]
+        futures = [
+            executor.submit(download_pdf, pdf_url, index, session, args.output_dir)
+            for pdf_url in pdf_links
+        ]
         
         # Wait for all downloads to complete
         downloaded_files = []
@@ -117,10 +100,13 @@ def main():
             if result:
                 downloaded_files.append(result)
     
+    index.save()
+
     print(f"\nDownload summary:")
     print(f"Total PDF links found: {len(pdf_links)}")
     print(f"Successfully downloaded: {len(downloaded_files)}")
-    print(f"Failed or skipped: {len(pdf_links) - len(downloaded_files)}")
+    print(f"Failed or not modified: {len(pdf_links) - len(downloaded_files)}")
+    print(index.counts_str())
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1 @@
+../../flow/src/pdf_probe.py
\ No newline at end of file
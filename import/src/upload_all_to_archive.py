@@ -1,33 +1,45 @@
+import argparse
 import datetime
 import json
 import os
-import sys
+import random
+import shutil
+import threading
 import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from pathlib import Path
 
-import internetarchive as ia
-import requests
+from download_index import DownloadIndex, IndexFile, fetch_pdf
 
 # Constants
-BatchSize = 50
+NumWorkers = 8
+MaxAttempts = 4
+BackoffSecs = 5
 FiveAndHalfHours = (5 * 60 * 60) + (30 * 60)  # 5 hours and 30 minutes in seconds
 
+Collection = "maharashtramls"
+DetailsURL = "https://archive.org/details/{}"
+
+# download index of each pdfs_dir, loaded once and shared by the upload threads
+download_indexes = {}
+download_indexes_lock = threading.Lock()
+
 
 def request_pdf(url, pdf_file):
     """Download a PDF file from a URL and save it to the specified path."""
     downloaded, dt_str = False, None
-    try:
-        print(f"Downloading {url}")
-        r = requests.get(url)
-        if r.status_code == 200:
-            with pdf_file.open("wb") as f:
-                f.write(r.content)
-            downloaded = True
-            dt_str = datetime.datetime.now(datetime.timezone.utc).strftime("%Y-%m-%d %H:%M:%S %Z%z")
-        else:
-            print(f"An error occurred while downloading {url} Status: {r.status_code}")
-    except Exception as e:
-        print(f"An exception occurred while downloading {url}: {e}")
+    print(f"Downloading {url}")
+
+    # streamed to a .part file, an interrupted download resumes on the next run
+    with download_indexes_lock:
+        if pdf_file.parent not in download_indexes:
+            download_indexes[pdf_file.parent] = DownloadIndex(pdf_file.parent / IndexFile)
+        index = download_indexes[pdf_file.parent]
+    result = fetch_pdf(url, pdf_file, index)
+    index.save()
+    if result != 'failed':
+        downloaded = True
+        dt_str = datetime.datetime.now(datetime.timezone.utc).strftime("%Y-%m-%d %H:%M:%S %Z%z")
 
     time.sleep(0.2)
     return downloaded, dt_str
@@ -56,10 +68,8 @@ def download_pdf(pdfs_dir, doc_info):
         return (pdf_file, d_utc_str) if d_success else (None, d_utc_str)
 
 
-def upload_internet_archive(doc_info, pdfs_dir):
-    """Upload a document to the Internet Archive."""
-    name = doc_info["name"]
-    doc_id = name.split(".")[0]  # Remove file extension
+def get_archive_metadata(doc_info):
+    """Get the archive identifier and the metadata of a document."""
     
     # Create description for the document
     descriptions = []
@@ -113,7 +123,7 @@ def upload_internet_archive(doc_info, pdfs_dir):
     identifier = f"{doc_info['year']}-{house_name}-{session_name}-{doc_type_name}{identifier_suffix}"
     
     metadata = {
-        "collection": "maharashtramls",
+        "collection": Collection,
         "mediatype": "texts",
         "title": title,
         "topics": "Maharashtra Legislature Secretariat Documents",
@@ -141,57 +151,226 @@ def upload_internet_archive(doc_info, pdfs_dir):
         metadata["date"] = doc_info["date"]
     
     ia_identifier = f"in.gov.maharashtra.mls.{identifier}"
+    return ia_identifier, metadata
+
+
+class Backend:
+    preflight = "fetch"
+
+    def find(self, ia_identifier):
+        raise NotImplementedError
+
+    def find_many(self, ia_identifiers, num_workers=NumWorkers):
+        """Returns {identifier: url} of the items that exist, by concurrent lookups."""
+        with ThreadPoolExecutor(max_workers=num_workers) as executor:
+            urls = executor.map(self.find, ia_identifiers)
+            return dict((i, u) for (i, u) in zip(ia_identifiers, urls) if u)
+
+
+class ArchiveBackend(Backend):
+    """Uploads to the Internet Archive, with the keys in IA_ACCESS_KEY and IA_SECRET_KEY or the
+    internetarchive config. The existing items are found with one listing of the collection,
+    or with a metadata fetch per item if preflight is 'fetch'.
+    """
+
+    def __init__(self, preflight="listing"):
+        # imported here, the local backend runs without internetarchive
+        import internetarchive
+
+        self.ia = internetarchive
+        self.access_key = os.environ.get("IA_ACCESS_KEY", "")
+        self.secret_key = os.environ.get("IA_SECRET_KEY", "")
+        self.preflight = preflight
+
+    def get_item(self, ia_identifier):
+        if self.access_key and self.secret_key:
+            config = {"s3": {"access": self.access_key, "secret": self.secret_key}}
+            return self.ia.get_item(ia_identifier, config)
+        return self.ia.get_item(ia_identifier)
+
+    def find(self, ia_identifier):
+        item = self.get_item(ia_identifier)
+        return item.urls.details if item.exists else None
+
+    def find_many(self, ia_identifiers, num_workers=NumWorkers):
+        if self.preflight == "fetch":
+            return super().find_many(ia_identifiers, num_workers)
+
+        # items uploaded in the last minutes may not be listed yet, they are looked up again
+        # by find before their upload
+        pending, found = set(ia_identifiers), {}
+        for result in self.ia.search_items(f"collection:{Collection}", fields=["identifier"]):
+            if result["identifier"] in pending:
+                found[result["identifier"]] = DetailsURL.format(result["identifier"])
+        return found
+
+    def upload(self, ia_identifier, pdf_path, metadata):
+        item = self.get_item(ia_identifier)
+        key_args = {}
+        if self.access_key and self.secret_key:
+            key_args = {"access_key": self.access_key, "secret_key": self.secret_key}
+        responses = item.upload(
+            str(pdf_path), metadata=metadata, validate_identifier=True, **key_args
+        )
+        return responses[0].url
+
+
+class LocalBackend(Backend):
+    """Stand-in for the archive that copies the pdf and the metadata to local_dir/identifier,
+    to run the uploader offline.
+    """
+
+    def __init__(self, local_dir):
+        self.local_dir = Path(local_dir).resolve()
+
+    def find(self, ia_identifier):
+        meta_file = self.local_dir / ia_identifier / "metadata.json"
+        return meta_file.parent.as_uri() if meta_file.exists() else None
+
+    def upload(self, ia_identifier, pdf_path, metadata):
+        item_dir = self.local_dir / ia_identifier
+        item_dir.mkdir(parents=True, exist_ok=True)
+        shutil.copyfile(pdf_path, item_dir / Path(pdf_path).name)
+        (item_dir / "metadata.json").write_text(json.dumps(metadata, indent=2, ensure_ascii=False))
+        return (item_dir / Path(pdf_path).name).as_uri()
+
+
+class UploadError(Exception):
+    pass
+
+
+def upload_internet_archive(doc_info, pdfs_dir, backend):
+    """Upload a document to the archive, raises UploadError if it fails."""
+    ia_identifier, metadata = get_archive_metadata(doc_info)
     print(f"\tSaving on archive: {ia_identifier}")
 
-    access_key = os.environ.get("IA_ACCESS_KEY", "")
-    secret_key = os.environ.get("IA_SECRET_KEY", "")
-
-    try:
-        if access_key and secret_key:
-            config = {"s3": {"access": access_key, "secret": secret_key}}
-            item = ia.get_item(ia_identifier, config)
-            if item.exists:
-                archive_url = item.urls.details
-                print(f"\tFound: {ia_identifier} {archive_url}")
-                return archive_url, ia_identifier
-            else:
-                (pdf_path, download_date_utc) = download_pdf(pdfs_dir, doc_info)
-                if pdf_path is not None and pdf_path.exists():
-                    pdf_path = str(pdf_path)
-                else:
-                    print(f"\tDownload Failed: {ia_identifier}")
-                    return None, None
-
-            responses = item.upload(
-                pdf_path,
-                metadata=metadata,
-                access_key=access_key,
-                secret_key=secret_key,
-                validate_identifier=True,
-            )
-        else:
-            # Check if PDF exists locally
-            pdf_path = get_pdf_path(doc_info, pdfs_dir)
-            if not pdf_path.exists():
-                (pdf_path, _) = download_pdf(pdfs_dir, doc_info)
-                if pdf_path is None:
-                    print(f"\tDownload Failed: {ia_identifier}")
-                    return None, None
-            
-            item = ia.get_item(ia_identifier)
-            responses = item.upload(str(pdf_path), metadata=metadata, validate_identifier=True)
+    # the listing lags behind recent uploads, an item it did not find may still exist
+    archive_url = backend.find(ia_identifier) if backend.preflight == "listing" else None
+    if archive_url:
+        print(f"\tAlready on archive: {ia_identifier} {archive_url}")
+        return archive_url, ia_identifier
 
-    except Exception as e:
-        print(f"Exception: {e}")
-        return None, None
+    # Check if PDF exists locally
+    pdf_path = get_pdf_path(doc_info, pdfs_dir)
+    if not pdf_path.exists():
+        (pdf_path, _) = download_pdf(pdfs_dir, doc_info)
+        if pdf_path is None:
+            raise UploadError(f"Download Failed: {ia_identifier}")
 
-    archive_url = responses[0].url
+    archive_url = backend.upload(ia_identifier, pdf_path, metadata)
     print(f"\tUploaded: {ia_identifier} {archive_url}")
     return archive_url, ia_identifier
 
 
-def upload_all_internet_archive(documents_json_file, archive_json_file, pdfs_dir):
-    """Upload all documents to the Internet Archive."""
+def upload_with_retry(doc_info, pdfs_dir, backend, max_attempts):
+    """Returns the journal record of the document, failed attempts are retried with an
+    exponential backoff.
+    """
+    record = {"name": doc_info["name"]}
+    for attempt in range(1, max_attempts + 1):
+        try:
+            archive_url, identifier = upload_internet_archive(doc_info, pdfs_dir, backend)
+            return dict(
+                record,
+                status="uploaded",
+                archive_url=archive_url,
+                identifier=identifier,
+                attempts=attempt,
+            )
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+            print(f"\t!!Failed {doc_info['name']} attempt {attempt}/{max_attempts}: {error}")
+            if attempt < max_attempts:
+                time.sleep(BackoffSecs * (2 ** (attempt - 1)) * (1 + random.random()))
+    return dict(record, status="failed", error=error, attempts=max_attempts)
+
+
+class UploadJournal:
+    """Append-only JSONL log of the outcome of each document, a record is flushed to disk as
+    soon as the document is done, a run resumes from the uploaded documents in the log.
+    """
+
+    def __init__(self, journal_file):
+        self.journal_file = Path(journal_file)
+        self.records = {}
+        if self.journal_file.exists():
+            for line in self.journal_file.read_text().splitlines():
+                # the last line may be cut short if the process was killed while writing it
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                self.records[record["name"]] = record
+        self.lock = threading.Lock()
+        self.journal_fp = self.journal_file.open("a")
+
+    def is_uploaded(self, name):
+        return self.records.get(name, {}).get("status") == "uploaded"
+
+    def append(self, record):
+        record = dict(record, time=datetime.datetime.now(datetime.timezone.utc).isoformat())
+        with self.lock:
+            self.records[record["name"]] = record
+            self.journal_fp.write(json.dumps(record, ensure_ascii=False) + "\n")
+            self.journal_fp.flush()
+            os.fsync(self.journal_fp.fileno())
+
+    def close(self):
+        self.journal_fp.close()
+
+
+class ExistsCache:
+    """Identifiers known to exist on the archive with their url, items are not removed from
+    the archive so an identifier once found is not looked up again.
+    """
+
+    def __init__(self, cache_file):
+        self.cache_file = Path(cache_file)
+        self.urls = json.loads(self.cache_file.read_text()) if self.cache_file.exists() else {}
+        self.lock = threading.Lock()
+
+    def get(self, ia_identifier):
+        return self.urls.get(ia_identifier, None)
+
+    def update(self, identifier_urls):
+        with self.lock:
+            self.urls.update(identifier_urls)
+
+    def save(self):
+        with self.lock:
+            self.cache_file.write_text(json.dumps(self.urls, indent=2, sort_keys=True))
+
+
+def preflight(backend, ia_identifiers, exists_cache, num_workers=NumWorkers):
+    """Returns {identifier: url} of the identifiers that already exist on the archive, only the
+    identifiers missing in the cache are looked up, all in one bulk call.
+    """
+    found = dict((i, exists_cache.get(i)) for i in ia_identifiers if exists_cache.get(i))
+    unknown = [i for i in ia_identifiers if i not in found]
+    new_found = backend.find_many(unknown, num_workers) if unknown else {}
+
+    exists_cache.update(new_found)
+    exists_cache.save()
+    found.update(new_found)
+
+    num_cached, num_todo = len(found) - len(new_found), len(ia_identifiers) - len(found)
+    print(
+        f"Pre-flight #pending: {len(ia_identifiers)} #cached: {num_cached}"
+        f" #found: {len(new_found)} #to upload: {num_todo}"
+    )
+    return found
+
+
+def upload_all_internet_archive(
+    documents_json_file,
+    archive_json_file,
+    pdfs_dir,
+    backend,
+    num_workers=NumWorkers,
+    max_attempts=MaxAttempts,
+    time_budget=FiveAndHalfHours,
+):
+    """Upload all documents to the archive, num_workers documents at a time."""
     # Read documents.json
     documents = json.loads(documents_json_file.read_text())
     
@@ -207,44 +386,76 @@ def upload_all_internet_archive(documents_json_file, archive_json_file, pdfs_dir
     
     # Get list of documents already uploaded to archive
     archive_ids = set(a.get("document_id", "") for a in archive_infos)
+    archive_ids.update(a["name"].split(".")[0] for a in archive_infos if a.get("upload_success"))
+
+    journal = UploadJournal(archive_json_file.parent / f'{archive_json_file.stem}_journal.jsonl')
     
     print(f'Existing documents in archive: {len(archive_ids)}')
     
     # Find documents not yet uploaded
     new_docs = [doc for doc in documents if doc["name"].split(".")[0] not in archive_ids]
+    new_docs = [doc for doc in new_docs if not journal.is_uploaded(doc["name"])]
     
-    print(f"*** New documents to upload: {len(new_docs)}")
+    # items already on the archive are resolved in bulk, only the rest reach the upload loop
+    exists_cache = ExistsCache(archive_json_file.parent / f'{archive_json_file.stem}_exists.json')
+    doc_identifiers = dict((doc["name"], get_archive_metadata(doc)[0]) for doc in new_docs)
+    found = preflight(backend, list(doc_identifiers.values()), exists_cache, num_workers)
+
+    upload_docs = []
+    for doc in new_docs:
+        ia_identifier = doc_identifiers[doc["name"]]
+        if ia_identifier in found:
+            record = {"name": doc["name"], "status": "uploaded", "identifier": ia_identifier}
+            journal.append(dict(record, archive_url=found[ia_identifier], attempts=0))
+        else:
+            upload_docs.append(doc)
+
+    print(f"*** New documents to upload: {len(upload_docs)} #workers: {num_workers}")
     
     # Create pdfs_dir if it doesn't exist
     pdfs_dir.mkdir(exist_ok=True)
     
     start_time = time.time()
-    for idx, doc in enumerate(new_docs):
-        doc_id = doc["name"].split(".")[0]
-        print(f"*** Uploading {doc_id} [{idx+1}/{len(new_docs)}]")
-        
-        archive_url, identifier = upload_internet_archive(doc, pdfs_dir)
-        if archive_url:
-            doc["archive_url"] = archive_url
-            doc["identifier"] = identifier
-            doc["upload_success"] = True
-            print(f"\t**Success: {archive_url}\n")
-        else:
-            doc["upload_success"] = False
-            print("\t!!Failed\n")
-        
+    docs_iter, in_flight, num_done = iter(upload_docs), set(), 0
+    with ThreadPoolExecutor(max_workers=num_workers) as executor:
+        while True:
+            # no new document is started once the time budget is spent
+            while len(in_flight) < num_workers and (time.time() - start_time) < time_budget:
+                doc = next(docs_iter, None)
+                if doc is None:
+                    break
+                future = executor.submit(upload_with_retry, doc, pdfs_dir, backend, max_attempts)
+                in_flight.add(future)
+
+            if not in_flight:
+                break
+
+            done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                record = future.result()
+                journal.append(record)
+                if record["status"] == "uploaded":
+                    exists_cache.update({record["identifier"]: record["archive_url"]})
+                num_done += 1
+                print(f"*** {record['status']} {record['name']} [{num_done}/{len(upload_docs)}]")
+
+    if num_done < len(upload_docs):
+        print('>>> Leaving as ran out of time')
+    journal.close()
+    exists_cache.save()
+
+    # archive.json is written once, from the journal, replacing the failures of earlier runs
+    new_names = set(doc["name"] for doc in new_docs)
+    archive_infos = [a for a in archive_infos if a.get("name") not in new_names]
+    for doc in documents:
+        record = journal.records.get(doc["name"], None)
+        if doc["name"] not in new_names or record is None:
+            continue
+        doc = dict(doc, upload_success=record["status"] == "uploaded")
+        if doc["upload_success"]:
+            doc.update(archive_url=record["archive_url"], identifier=record["identifier"])
         archive_infos.append(doc)
-        
-        if (idx + 1) % BatchSize == 0:  # Save after every BatchSize uploads
-            archive_json_file.write_text(json.dumps(archive_infos, indent=2))
-            print('>>> Written Files <<<')
-        
-        if (time.time() - start_time) > FiveAndHalfHours:
-            archive_json_file.write_text(json.dumps(archive_infos, indent=2))
-            print('>>> Leaving as ran out of time')
-            break
-    
-    # Final save
+
     if new_docs:
         archive_json_file.write_text(json.dumps(archive_infos, indent=2))
         print('>>> Final save completed <<<')
@@ -252,15 +463,46 @@ def upload_all_internet_archive(documents_json_file, archive_json_file, pdfs_dir
 
 def main():
     """Main function to handle command line arguments and start the upload process."""
-    if len(sys.argv) != 4:
-        print("Usage: python upload_all_to_archive.py <documents_json_file> <archive_json_file> <pdfs_dir>")
-        sys.exit(1)
-    
-    documents_json_file = Path(sys.argv[1])
-    archive_json_file = Path(sys.argv[2])
-    pdfs_dir = Path(sys.argv[3])
-    
-    upload_all_internet_archive(documents_json_file, archive_json_file, pdfs_dir)
+    parser = argparse.ArgumentParser(description="Upload the documents to the Internet Archive.")
+    parser.add_argument("documents_json_file", type=Path)
+    parser.add_argument("archive_json_file", type=Path)
+    parser.add_argument("pdfs_dir", type=Path)
+    parser.add_argument("-w", "--workers", type=int, default=NumWorkers, help="uploads in flight")
+    parser.add_argument("-a", "--max-attempts", type=int, default=MaxAttempts)
+    parser.add_argument("-t", "--time-budget", type=float, default=FiveAndHalfHours, help="secs")
+    parser.add_argument(
+        "-l",
+        "--local-dir",
+        type=Path,
+        help="upload to this dir, not the archive, the archive json and the journal are kept in it",
+    )
+    parser.add_argument(
+        "-p",
+        "--preflight",
+        choices=["listing", "fetch"],
+        default="listing",
+        help="find the existing items with a collection listing or a fetch per item",
+    )
+    args = parser.parse_args()
+
+    archive_json_file = args.archive_json_file
+    if args.local_dir:
+        # a local run must not mark documents as uploaded in the archive json of the archive
+        args.local_dir.mkdir(parents=True, exist_ok=True)
+        archive_json_file = args.local_dir / archive_json_file.name
+        backend = LocalBackend(args.local_dir)
+    else:
+        backend = ArchiveBackend(args.preflight)
+
+    upload_all_internet_archive(
+        args.documents_json_file,
+        archive_json_file,
+        args.pdfs_dir,
+        backend,
+        args.workers,
+        args.max_attempts,
+        args.time_budget,
+    )
 
 
 if __name__ == "__main__":